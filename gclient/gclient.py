@@ -63,24 +63,82 @@ Hooks
     ]
 """
 
+from __future__ import print_function
+
 __author__ = "darinf@gmail.com (Darin Fisher)"
 __version__ = "0.3.1"
 
+import ast
+import codecs
+import copy
 import errno
+import json
+import locale
 import optparse
 import os
 import re
 import stat
 import subprocess
 import sys
+import tempfile
+import threading
 import time
-import urlparse
-import xml.dom.minidom
-import urllib
+
+# Python 3 renamed or moved these.
+try:
+  from cStringIO import StringIO
+except ImportError:
+  from io import StringIO
+try:
+  import Queue
+except ImportError:
+  import queue as Queue
+try:
+  from urlparse import urlparse
+except ImportError:
+  from urllib.parse import urlparse
+try:
+  import xml.etree.cElementTree as ElementTree
+except ImportError:
+  import xml.etree.ElementTree as ElementTree
+
+try:
+  from urllib import quote, unquote
+except ImportError:
+  from urllib.parse import quote, unquote
+
+# Python can be built without sqlite3; svn is then asked for the info of
+# checkouts instead of reading their .svn/wc.db.
+try:
+  import sqlite3
+except ImportError:
+  sqlite3 = None
+
+# The optional libsvn bindings, only imported with --pysvn since loading
+# libsvn is slow; False once they turned out not to be installed.
+pysvn = None
 
 
 SVN_COMMAND = "svn"
 
+# The characters svn leaves unescaped in the urls it prints.
+SVN_URL_SAFE_CHARS = "/!~*'()@:&=+$,"
+
+# The most checkouts updated by a single 'svn update'.
+SVN_UPDATE_BATCH_SIZE = 50
+
+# Maps sys.platform values and --deps names to the keys of a DEPS deps_os.
+DEPS_OS_CHOICES = {
+    "win32": "win",
+    "win": "win",
+    "cygwin": "win",
+    "darwin": "mac",
+    "mac": "mac",
+    "unix": "unix",
+    "linux": "unix",
+    "linux2": "unix",
+}
+
 
 # default help text
 DEFAULT_USAGE_TEXT = (
@@ -128,6 +186,7 @@ Valid options:
   --revision REV      : update/checkout all solutions with specified revision
   --revision SOLUTION@REV : update given solution to specified revision
   --deps PLATFORM(S)  : sync deps for the given platform(s), or 'all'
+  --jobs N            : run up to N svn commands in parallel
   --verbose           : output additional diagnostics
 
 Examples:
@@ -147,6 +206,7 @@ Additional options and args may be passed to 'svn cleanup'.
 usage: cleanup [options] [--] [svn cleanup args/options]
 
 Valid options:
+  --jobs N            : run up to N svn commands in parallel
   --verbose           : output additional diagnostics
 """,
     "config": """Create a .gclient file in the current directory; this
@@ -177,6 +237,7 @@ gclient options.
 usage: diff [options] [--] [svn args/options]
 
 Valid options:
+  --jobs N             : run up to N svn commands in parallel
   --verbose            : output additional diagnostics
 
 Examples:
@@ -199,10 +260,9 @@ for each module.  Additional options and args may be passed to 'svn diff'.
 usage: status [options] [--] [svn diff args/options]
 
 Valid options:
+  --jobs N            : run up to N svn commands in parallel
   --verbose           : output additional diagnostics
 """,
-    "sync": GENERIC_UPDATE_USAGE_TEXT % {"cmd": "sync", "alias": "update"},
-    "update": GENERIC_UPDATE_USAGE_TEXT % {"cmd": "update", "alias": "sync"},
     "help": """Describe the usage of this program or its subcommands.
 
 usage: help [options] [subcommand]
@@ -229,6 +289,20 @@ usage: revinfo [options]
 """,
 }
 
+# "sync" and "update" are aliases; their help text is only formatted from
+# GENERIC_UPDATE_USAGE_TEXT when asked for.
+UPDATE_COMMAND_ALIASES = {"sync": "update", "update": "sync"}
+
+
+def GetCommandUsage(command):
+  """Returns the help text of a subcommand, or None if there is no such
+  subcommand."""
+  if command in UPDATE_COMMAND_ALIASES:
+    return GENERIC_UPDATE_USAGE_TEXT % {
+        "cmd": command, "alias": UPDATE_COMMAND_ALIASES[command]}
+  return COMMAND_USAGE_TEXT.get(command)
+
+
 # parameterized by (solution_name, solution_url, safesync_url)
 DEFAULT_CLIENT_FILE_TEXT = (
     """
@@ -259,26 +333,6 @@ solutions = [
 ## Generic utils
 
 
-def getText(nodelist):
-  """
-  Return the concatenated text for the children of a list of DOM nodes.
-  """
-  rc = []
-  for node in nodelist:
-    if node.nodeType == node.TEXT_NODE:
-      rc.append(node.data)
-    else:
-      rc.append(getText(node.childNodes))
-  return ''.join(rc)
-
-
-def ParseXML(output):
-  try:
-    return xml.dom.minidom.parseString(output)
-  except xml.parsers.expat.ExpatError:
-    return None
-
-
 class Error(Exception):
   """gclient exception class."""
   pass
@@ -295,7 +349,11 @@ class PrintableObject(object):
 
 def FileRead(filename):
   content = None
-  f = open(filename, "rU")
+  # Newlines are translated by default in Python 3, which has no "U" mode.
+  if sys.version_info[0] < 3:
+    f = open(filename, "rU")
+  else:
+    f = open(filename, "r")
   try:
     content = f.read()
   finally:
@@ -303,12 +361,181 @@ def FileRead(filename):
   return content
 
 
+# Maps (start directory, config filename) to the directory holding the
+# config file, as found by GClient.LoadCurrentConfig.
+_config_dirs = {}
+
+# Maps (filename, source) to the code object compiled from it.
+_compiled_sources = {}
+
+# Maps (program, %PATH%, %PATHEXT%) to the result of _FindExecutable().
+_resolved_programs = {}
+
+
+def CompileCached(source, filename):
+  """Compiles Python source, reusing the code object for identical source.
+
+  DEPS and .gclient_entries files are small Python files that may be evaluated
+  many times during a single run; this only pays the parsing cost once.
+
+  Args:
+    source: The Python source to compile.
+    filename: The file the source came from, used in tracebacks.
+
+  Returns:
+    A code object suitable for exec.
+  """
+  key = (filename, source)
+  code = _compiled_sources.get(key)
+  if code is None:
+    code = compile(source, filename, 'exec')
+    _compiled_sources[key] = code
+  return code
+
+
+# The syntax tree nodes holding literal values.
+if sys.version_info >= (3, 8):
+  _AST_CONSTANTS = (ast.Constant,)
+else:
+  _AST_CONSTANTS = tuple([getattr(ast, name)
+                          for name in ('Str', 'Bytes', 'Num', 'NameConstant')
+                          if hasattr(ast, name)])
+
+
+class _UnsupportedDepsSyntax(Exception):
+  """Raised by _EvalDepsNode on anything it doesn't evaluate itself."""
+  pass
+
+
+def _EvalDepsNode(node, functions, scope):
+  """Evaluates an expression of a DEPS file; see EvalDepsSource."""
+  if isinstance(node, _AST_CONSTANTS):
+    for attr in ('value', 's', 'n'):
+      if hasattr(node, attr):
+        return getattr(node, attr)
+  if isinstance(node, ast.Name):
+    # True, False and None are names in Python 2.
+    constants = {'True': True, 'False': False, 'None': None}
+    if node.id in constants:
+      return constants[node.id]
+    if node.id in scope:
+      return scope[node.id]
+  elif isinstance(node, ast.Dict):
+    if None not in node.keys:
+      return dict([(_EvalDepsNode(k, functions, scope),
+                    _EvalDepsNode(v, functions, scope))
+                   for k, v in zip(node.keys, node.values)])
+  elif isinstance(node, (ast.List, ast.Tuple)):
+    items = [_EvalDepsNode(elt, functions, scope) for elt in node.elts]
+    if isinstance(node, ast.Tuple):
+      return tuple(items)
+    return items
+  elif isinstance(node, ast.BinOp) and isinstance(node.op, (ast.Add, ast.Mod)):
+    left = _EvalDepsNode(node.left, functions, scope)
+    right = _EvalDepsNode(node.right, functions, scope)
+    if isinstance(node.op, ast.Add):
+      return left + right
+    return left % right
+  elif (isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and
+        node.func.id in functions and not node.keywords and
+        not getattr(node, 'starargs', None) and
+        not getattr(node, 'kwargs', None)):
+    args = [_EvalDepsNode(arg, functions, scope) for arg in node.args]
+    return functions[node.func.id](*args)
+  raise _UnsupportedDepsSyntax()
+
+
+def EvalDepsSource(source, filename, functions, scope):
+  """Evaluates a DEPS file without running it as Python code.
+
+  DEPS files are expected to only assign literals, possibly built with '+',
+  '%' and calls to |functions| such as From() and Var().  Walking the syntax
+  tree of such assignments is cheaper than running them and doesn't execute
+  arbitrary code.
+
+  Args:
+    source: The content of the DEPS file.
+    filename: The file the source came from, used in syntax errors.
+    functions: A dict of the functions the source may call, by name.
+    scope: The dict receiving the assigned names.
+
+  Returns:
+    False if the source uses anything else, in which case the content of scope
+    is undefined and the source has to be exec'd instead.
+  """
+  for statement in ast.parse(source, filename).body:
+    if not (isinstance(statement, ast.Assign) and
+            len(statement.targets) == 1 and
+            isinstance(statement.targets[0], ast.Name)):
+      return False
+    try:
+      value = _EvalDepsNode(statement.value, functions, scope)
+    except _UnsupportedDepsSyntax:
+      return False
+    scope[statement.targets[0].id] = value
+  return True
+
+
+# The umask can only be read by setting it, which is done while gclient is
+# still single-threaded.
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
 def FileWrite(filename, content):
-  f = open(filename, "w")
+  """Replaces the content of filename atomically.
+
+  The content goes to a temporary file first so that an interrupted write
+  doesn't leave a truncated .gclient or .gclient_entries behind.
+  """
+  # Write through symlinks instead of replacing them with a plain file.
+  filename = os.path.realpath(filename)
+  try:
+    mode = stat.S_IMODE(os.stat(filename).st_mode)
+  except OSError:
+    # The mode open() would have given a new file.
+    mode = 0o666 & ~_UMASK
+  # mkstemp picks a name nobody else uses, next to filename so that the
+  # rename stays on one filesystem.
+  fd, tmp_filename = tempfile.mkstemp(dir=os.path.dirname(filename) or ".")
+  try:
+    f = os.fdopen(fd, "w")
+    try:
+      f.write(content)
+    finally:
+      f.close()
+    # mkstemp creates the file readable by its owner only.
+    os.chmod(tmp_filename, mode)
+    if hasattr(os, "replace"):
+      os.replace(tmp_filename, filename)
+    else:
+      # Python 2's os.rename can't overwrite an existing file on Windows.
+      if sys.platform in ("win32", "cygwin") and os.path.exists(filename):
+        os.remove(filename)
+      os.rename(tmp_filename, filename)
+  except:
+    try:
+      os.remove(tmp_filename)
+    except OSError:
+      pass
+    raise
+
+
+def UrlRead(url):
+  """Returns the content of url, e.g. a safesync_url.
+
+  urlopen is only imported here; on Python 3, urllib.request is slow to import
+  and most commands never fetch anything.
+  """
   try:
-    f.write(content)
+    from urllib import urlopen
+  except ImportError:
+    from urllib.request import urlopen
+  handle = urlopen(url)
+  try:
+    return handle.read().decode('utf-8')
   finally:
-    f.close()
+    handle.close()
 
 
 def RemoveDirectory(*path):
@@ -372,10 +599,10 @@ def RemoveDirectory(*path):
           win32api.SetFileAttributes(fullpath, win32con.FILE_ATTRIBUTE_NORMAL)
       try:
         os.remove(fullpath)
-      except OSError, e:
+      except OSError as e:
         if e.errno != errno.EACCES or sys.platform != 'win32':
           raise
-        print 'Failed to delete %s: trying again' % fullpath
+        print('Failed to delete %s: trying again' % fullpath)
         time.sleep(0.1)
         os.remove(fullpath)
     else:
@@ -387,15 +614,60 @@ def RemoveDirectory(*path):
       win32api.SetFileAttributes(file_path, win32con.FILE_ATTRIBUTE_NORMAL)
   try:
     os.rmdir(file_path)
-  except OSError, e:
+  except OSError as e:
     if e.errno != errno.EACCES or sys.platform != 'win32':
       raise
-    print 'Failed to remove %s: trying again' % file_path
+    print('Failed to remove %s: trying again' % file_path)
     time.sleep(0.1)
     os.rmdir(file_path)
 
 
-def SubprocessCall(command, in_directory, out, fail_status=None):
+def ResolveCommand(command):
+  """Returns the (command, shell) pair to pass to subprocess for command, a
+  list.
+
+  *Sigh*:  Windows needs shell=True, or else it won't search %PATH% for batch
+  file wrappers like svn.bat, but shell=True makes subprocess on Linux fail when
+  it's called with a list because it only tries to execute the first item in
+  the list.  When the program is a real executable, it is run directly with its
+  full path so that Windows doesn't have to start a cmd.exe on every call.
+  """
+  if sys.platform != 'win32':
+    return command, False
+  # The lookup walks all of %PATH%, so it is only done once per program.
+  key = (command[0], os.environ.get('PATH', ''),
+         os.environ.get('PATHEXT', '.COM;.EXE;.BAT;.CMD'))
+  if key not in _resolved_programs:
+    _resolved_programs[key] = _FindExecutable(*key)
+  executable = _resolved_programs[key]
+  if executable:
+    return [executable] + command[1:], False
+  return command, True
+
+
+def _FindExecutable(program, path, pathext):
+  """Returns the full path of the real executable that Windows would run for
+  program, or None if it's not found or is a batch file."""
+  if os.path.splitext(program)[1]:
+    candidates = [program]
+  else:
+    candidates = [program + extension for extension in pathext.split(';')]
+  if os.path.dirname(program):
+    directories = ['']
+  else:
+    directories = path.split(os.pathsep)
+  for directory in directories:
+    for candidate in candidates:
+      full_path = os.path.join(directory, candidate)
+      if os.path.isfile(full_path):
+        if os.path.splitext(full_path)[1].lower() in ('.com', '.exe'):
+          return full_path
+        return None
+  return None
+
+
+def SubprocessCall(command, in_directory, out, fail_status=None,
+                   buffered=False):
   """Runs command, a list, in directory in_directory.
 
   This function wraps SubprocessCallAndCapture, but does not perform the
@@ -403,15 +675,18 @@ def SubprocessCall(command, in_directory, out, fail_status=None):
   description.
   """
   # Call subprocess and capture nothing:
-  SubprocessCallAndCapture(command, in_directory, out, fail_status)
+  SubprocessCallAndCapture(command, in_directory, out, fail_status,
+                           buffered=buffered)
 
 
 def SubprocessCallAndCapture(command, in_directory, out, fail_status=None,
-                             pattern=None, capture_list=None):
+                             pattern=None, capture_list=None, buffered=False):
   """Runs command, a list, in directory in_directory.
 
   A message indicating what is being done, as well as the command's stdout,
-  is printed to out.
+  is printed to out.  When out is buffered, i.e. nobody sees it before the
+  command is done, the output is read a line at a time rather than a byte at
+  a time.
 
   If a pattern is specified, any line in the output matching pattern will have
   its first match group appended to capture_list.
@@ -421,14 +696,20 @@ def SubprocessCallAndCapture(command, in_directory, out, fail_status=None,
   default), gclient will raise an Error exception.
   """
 
-  print >> out, ("\n________ running \'%s\' in \'%s\'"
-      % (' '.join(command), in_directory))
+  print("\n________ running \'%s\' in \'%s\'"
+        % (' '.join(command), in_directory), file=out)
 
-  # *Sigh*:  Windows needs shell=True, or else it won't search %PATH% for the
-  # executable, but shell=True makes subprocess on Linux fail when it's called
-  # with a list because it only tries to execute the first item in the list.
-  kid = subprocess.Popen(command, bufsize=0, cwd=in_directory,
-      shell=(sys.platform == 'win32'), stdout=subprocess.PIPE)
+  popen_command, shell = ResolveCommand(command)
+  kid = subprocess.Popen(popen_command, bufsize=0, cwd=in_directory,
+      shell=shell, stdout=subprocess.PIPE)
+
+  # Python 3 reads bytes.  They are decoded here rather than by Popen's
+  # universal_newlines, which would turn a bare '\r' into a line break.
+  if bytes is str:
+    decode = lambda data: data
+  else:
+    decode = codecs.getincrementaldecoder(
+        locale.getpreferredencoding(False))("replace").decode
 
   if pattern:
     compiled_pattern = re.compile(pattern)
@@ -437,30 +718,63 @@ def SubprocessCallAndCapture(command, in_directory, out, fail_status=None,
   # This has to be done on a per byte basis to make sure it is not buffered:
   # normally buffering is done for each line, but if svn requests input, no
   # end-of-line character is output after the prompt and it would not show up.
-  in_byte = kid.stdout.read(1)
+  # Output that is buffered anyway, like with --jobs, is read a line at a time
+  # since nobody would see the prompt.
+  if buffered:
+    read = kid.stdout.readline
+  else:
+    read = lambda: kid.stdout.read(1)
+  data = read()
   in_line = ""
-  while in_byte:
-    if in_byte != "\r":
-      out.write(in_byte)
-      in_line += in_byte
-    if in_byte == "\n" and pattern:
-      match = compiled_pattern.search(in_line[:-1])
-      if match:
-        capture_list.append(match.group(1))
-      in_line = ""
-    in_byte = kid.stdout.read(1)
+  while data:
+    chunk = decode(data).replace("\r", "")
+    out.write(chunk)
+    if pattern:
+      in_line += chunk
+      if "\n" in chunk:
+        lines = in_line.split("\n")
+        in_line = lines.pop()
+        for line in lines:
+          match = compiled_pattern.search(line)
+          if match:
+            capture_list.append(match.group(1))
+    data = read()
   rv = kid.wait()
 
   if rv:
     msg = "failed to run command: %s" % " ".join(command)
 
     if fail_status != None:
-      print >>sys.stderr, msg
+      print(msg, file=sys.stderr)
       sys.exit(fail_status)
 
     raise Error(msg)
 
 
+def SplitUrlRevision(url):
+  """Splits a "url@revision" string into its url and revision.
+
+  Only an '@' after the last '/' counts, so that urls with user names like
+  svn://user@host/path are left alone.
+
+  Returns:
+    A (url, revision) tuple; revision is None if url has none.
+  """
+  url_part, sep, revision = url.rpartition('@')
+  if not sep or '/' in revision:
+    return (url, None)
+  return (url_part, revision)
+
+
+def CanonicalSVNUrl(url):
+  """Returns url escaped and without a trailing '/', as svn info prints it."""
+  url = unquote(url.rstrip('/'))
+  if not isinstance(url, str):
+    # A unicode url on Python 2.
+    url = url.encode('utf-8')
+  return quote(url, SVN_URL_SAFE_CHARS)
+
+
 def IsUsingGit(root, paths):
   """Returns True if we're using git to manage any of our checkouts.
   |entries| is a list of paths to check."""
@@ -469,6 +783,67 @@ def IsUsingGit(root, paths):
       return True
   return False
 
+
+def FindParentPaths(paths):
+  """Finds the closest directory each path is nested in, among paths.
+
+  Returns a dict mapping each path to its parent in paths, or to None if it
+  isn't nested in any of them.
+  """
+  path_by_key = dict((path.replace(os.sep, '/'), path) for path in paths)
+  parents = {}
+  for key, path in path_by_key.items():
+    parts = key.split('/')
+    parent = None
+    for i in range(len(parts) - 1, 0, -1):
+      parent = path_by_key.get('/'.join(parts[:i]))
+      if parent is not None:
+        break
+    parents[path] = parent
+  return parents
+
+
+def RunInParallel(tasks, jobs):
+  """Runs each callable in tasks using up to jobs worker threads.
+
+  Tasks are started in order.  Once a task raises, even KeyboardInterrupt or
+  SystemExit, no further task is started; the exception is re-raised in the
+  calling thread after the tasks already running have completed.  The same
+  goes for a KeyboardInterrupt received by the calling thread itself.
+  """
+  pending = Queue.Queue()
+  for task in tasks:
+    pending.put(task)
+  errors = []
+
+  def Worker():
+    while not errors:
+      try:
+        task = pending.get_nowait()
+      except Queue.Empty:
+        return
+      try:
+        task()
+      except BaseException as e:
+        errors.append(e)
+
+  threads = [threading.Thread(target=Worker)
+             for i in range(min(jobs, len(tasks)))]
+  for thread in threads:
+    thread.start()
+  try:
+    for thread in threads:
+      # On Python 2, a join without a timeout can't be interrupted by Ctrl-C.
+      while thread.is_alive():
+        thread.join(1)
+  except KeyboardInterrupt as e:
+    errors.append(e)
+    for thread in threads:
+      while thread.is_alive():
+        thread.join(1)
+  if errors:
+    raise errors[0]
+
 # -----------------------------------------------------------------------------
 # SVN utils:
 
@@ -486,7 +861,8 @@ def RunSVN(options, args, in_directory):
   c = [SVN_COMMAND]
   c.extend(args)
 
-  SubprocessCall(c, in_directory, options.stdout)
+  SubprocessCall(c, in_directory, options.stdout,
+                 buffered=options.buffered_output)
 
 
 def CaptureSVN(options, args, in_directory):
@@ -502,12 +878,10 @@ def CaptureSVN(options, args, in_directory):
   c = [SVN_COMMAND]
   c.extend(args)
 
-  # *Sigh*:  Windows needs shell=True, or else it won't search %PATH% for
-  # the svn.exe executable, but shell=True makes subprocess on Linux fail
-  # when it's called with a list because it only tries to execute the
-  # first string ("svn").
-  return subprocess.Popen(c, cwd=in_directory, shell=(sys.platform == 'win32'),
-                          stdout=subprocess.PIPE).communicate()[0]
+  c, shell = ResolveCommand(c)
+  return subprocess.Popen(c, cwd=in_directory, shell=shell,
+                          stdout=subprocess.PIPE,
+                          universal_newlines=True).communicate()[0]
 
 
 def RunSVNAndGetFileList(options, args, in_directory, file_list):
@@ -551,7 +925,37 @@ def RunSVNAndGetFileList(options, args, in_directory, file_list):
       }[args[0]]
 
   SubprocessCallAndCapture(command, in_directory, options.stdout,
-                           pattern=pattern, capture_list=file_list)
+                           pattern=pattern, capture_list=file_list,
+                           buffered=options.buffered_output)
+
+
+def RunSVNUpdates(options, updates, in_directory, file_list):
+  """Updates several checkouts with as few 'svn update' runs as possible.
+
+  The checkouts to be updated to the same revision are updated by a single
+  svn process, which also reuses its connection to a repository across them.
+
+  Args:
+    updates: A list of (revision, path) tuples.  A revision of None means
+      HEAD.
+    in_directory: The directory where svn is to be run.
+    file_list: Updated files are appended to it, as in RunSVNAndGetFileList.
+  """
+  revisions = []
+  paths_by_revision = {}
+  for revision, path in updates:
+    if revision not in paths_by_revision:
+      revisions.append(revision)
+      paths_by_revision[revision] = []
+    paths_by_revision[revision].append(path)
+  for revision in revisions:
+    paths = paths_by_revision[revision]
+    # Keep the command line well within the limits of Windows.
+    for i in range(0, len(paths), SVN_UPDATE_BATCH_SIZE):
+      command = ["update"] + paths[i:i + SVN_UPDATE_BATCH_SIZE]
+      if revision:
+        command.extend(['--revision', str(revision)])
+      RunSVNAndGetFileList(options, command, in_directory, file_list)
 
 
 def CaptureSVNInfo(options, relpath, in_directory):
@@ -565,18 +969,199 @@ def CaptureSVNInfo(options, relpath, in_directory):
   Returns:
     An object with fields corresponding to the output of 'svn info'
   """
+  if '://' not in relpath:
+    info = ReadSVNWorkingCopyInfo(os.path.join(in_directory, relpath))
+    if info:
+      return info
+  if options.use_pysvn:
+    info = CaptureSVNInfoPySVN(relpath, in_directory)
+    if info:
+      return info
   info = CaptureSVN(options, ["info", "--xml", relpath], in_directory)
-  dom = xml.dom.minidom.parseString(info)
+  return ParseSVNInfo(info)[0][1]
+
+
+# pysvn.Client objects can't be shared by threads; this keeps one per thread.
+_pysvn_clients = threading.local()
+
+
+def CaptureSVNInfoPySVN(relpath, in_directory):
+  """Like CaptureSVNInfo, but asks libsvn directly through pysvn.
+
+  This saves starting an svn process, and the client keeps its repository
+  sessions and authentication cache from one call to the next. It can't
+  prompt for credentials or certificates, though, so it's only used with
+  --pysvn.
+
+  Returns:
+    The info object, or None if pysvn isn't installed or couldn't get it;
+    svn itself should be asked then.
+  """
+  global pysvn
+  if pysvn is None:
+    try:
+      import pysvn
+    except ImportError:
+      pysvn = False
+  if not pysvn:
+    return None
+  client = getattr(_pysvn_clients, 'client', None)
+  if client is None:
+    client = _pysvn_clients.client = pysvn.Client()
+  relpath, revision = SplitUrlRevision(relpath)
+  kwargs = {}
+  if revision:
+    if revision.isdigit():
+      revision = pysvn.Revision(pysvn.opt_revision_kind.number, int(revision))
+    elif revision.upper() == 'HEAD':
+      revision = pysvn.Revision(pysvn.opt_revision_kind.head)
+    else:
+      # Dates and the like are left to svn.
+      return None
+    # Like svn, url@rev looks the url up at rev and describes it there.
+    kwargs['peg_revision'] = revision
+    kwargs['revision'] = revision
+  if '://' not in relpath:
+    relpath = os.path.join(in_directory, relpath)
+  try:
+    entry = client.info2(relpath, recurse=False, **kwargs)[0][1]
+  except pysvn.ClientError:
+    return None
+  result = PrintableObject()
+  result.root = str(entry['repos_root_URL'])
+  result.url = str(entry['URL'])
+  result.uuid = str(entry['repos_UUID'])
+  result.revision = int(entry['rev'].number)
+  return result
 
-  # str() the getText() results because they may be returned as
-  # Unicode, which interferes with the higher layers matching up
-  # things in the deps dictionary.
+
+def CaptureSVNInfoBatch(options, relpaths, in_directory):
+  """Runs a single 'svn info' on several existing paths or urls.
+
+  svn reuses its connection to a repository across the targets of a single
+  invocation, so this is also cheaper than querying urls one by one.
+
+  Args:
+    relpaths: The directories where the working copies reside relative to
+      the directory given by in_directory, or repository urls.
+    in_directory: The directory where svn is to be run.
+
+  Returns:
+    A dict mapping each of relpaths svn knows about to an object like the one
+    returned by CaptureSVNInfo.
+  """
+  results = {}
+  to_query = []
+  for relpath in relpaths:
+    info = None
+    if '://' not in relpath:
+      info = ReadSVNWorkingCopyInfo(os.path.join(in_directory, relpath))
+    if info:
+      results[relpath] = info
+    else:
+      to_query.append(relpath)
+  if not to_query:
+    return results
+  info = CaptureSVN(options, ["info", "--xml"] + to_query, in_directory)
+  requested = dict([(os.path.normpath(p), p) for p in to_query])
+  requested_urls = dict([(CanonicalSVNUrl(p), p) for p in to_query
+                         if '://' in p])
+  for path, entry in ParseSVNInfo(info):
+    relpath = requested_urls.get(CanonicalSVNUrl(entry.url))
+    if relpath is not None:
+      # A url target; svn only reports its basename as the path.
+      results[relpath] = entry
+      continue
+    relpath = requested.get(os.path.normpath(path))
+    if relpath is not None:
+      results[relpath] = entry
+  return results
+
+
+def ParseSVNInfo(output):
+  """Parses the output of 'svn info --xml'.
+
+  The output is parsed incrementally and each <entry> element is discarded
+  once converted, so large outputs from batched calls stay cheap.
+
+  Returns:
+    A list of (path, info) tuples, one per entry, where info is the object
+    returned by CaptureSVNInfo. Empty if the output isn't valid XML.
+  """
+  results = []
+  try:
+    for _, element in ElementTree.iterparse(StringIO(output)):
+      if element.tag == 'entry':
+        results.append((element.get('path'), ParseSVNInfoEntry(element)))
+        element.clear()
+  except SyntaxError:
+    # Raised by ElementTree for malformed XML.
+    return []
+  return results
+
+
+def ParseSVNInfoEntry(entry):
+  """Converts an <entry> element of 'svn info --xml' into the object returned
+  by CaptureSVNInfo."""
+  # str() the text because it may be returned as Unicode, which interferes
+  # with the higher layers matching up things in the deps dictionary.
+  result = PrintableObject()
+  result.root = str(entry.findtext('repository/root', ''))
+  result.url = str(entry.findtext('url', ''))
+  result.uuid = str(entry.findtext('repository/uuid', ''))
+  result.revision = int(entry.get('revision'))
+  return result
+
+
+def ReadSVNWorkingCopyInfo(path):
+  """Reads the info of a working copy root straight from its .svn/wc.db.
+
+  svn 1.7+ keeps the url and revision of each node in an SQLite database, so
+  for a checkout root this gives the same answer as 'svn info' without
+  starting a process.
+
+  Returns:
+    An object like the one returned by CaptureSVNInfo, or None if path isn't
+    the root of a working copy this can read, in which case 'svn info' has to
+    be asked instead.
+  """
+  if sqlite3 is None:
+    return None
+  db_path = os.path.join(path, '.svn', 'wc.db')
+  if not os.path.isfile(db_path):
+    return None
+  try:
+    db = sqlite3.connect(db_path)
+    try:
+      row = db.execute(
+          "SELECT REPOSITORY.root, REPOSITORY.uuid, NODES.repos_path, "
+          "NODES.revision FROM NODES JOIN REPOSITORY "
+          "ON NODES.repos_id = REPOSITORY.id "
+          "WHERE NODES.local_relpath = '' AND NODES.op_depth = 0 "
+          "AND NODES.presence = 'normal'").fetchone()
+    finally:
+      db.close()
+  except sqlite3.Error:
+    # An older or newer format than expected, or a locked database.
+    return None
+  if not row or row[3] is None:
+    return None
+  root, uuid, repos_path, revision = row
+  try:
+    root.encode('ascii')
+    uuid.encode('ascii')
+  except UnicodeError:
+    # Python 2 can't make a str of these; svn info knows what to show.
+    return None
   result = PrintableObject()
-  result.root = str(getText(dom.getElementsByTagName('root')))
-  result.url = str(getText(dom.getElementsByTagName('url')))
-  result.uuid = str(getText(dom.getElementsByTagName('uuid')))
-  result.revision = int(dom.getElementsByTagName('entry')[0].getAttribute(
-                            'revision'))
+  result.root = str(root)
+  # The path is stored decoded; svn info prints it escaped like this.
+  repos_path = quote(repos_path.encode('utf-8'), SVN_URL_SAFE_CHARS)
+  result.url = result.root
+  if repos_path:
+    result.url += '/' + repos_path
+  result.uuid = str(uuid)
+  result.revision = int(revision)
   return result
 
 
@@ -587,8 +1172,7 @@ def CaptureSVNHeadRevision(options, url):
     Int head revision
   """
   info = CaptureSVN(options, ["info", "--xml", url], os.getcwd())
-  dom = xml.dom.minidom.parseString(info)
-  return int(dom.getElementsByTagName('entry')[0].getAttribute('revision'))
+  return ParseSVNInfo(info)[0][1].revision
 
 
 class FileStatus:
@@ -613,50 +1197,54 @@ def CaptureSVNStatus(options, path):
   Returns:
     An array of FileStatus corresponding to the emulated output of 'svn status'
     version 1.5."""
-  dom = ParseXML(CaptureSVN(options, ["status", "--xml"], path))
+  output = CaptureSVN(options, ["status", "--xml"], path)
   results = []
-  if dom:
+  try:
     # /status/target/entry/(wc-status|commit|author|date)
-    for target in dom.getElementsByTagName('target'):
-      base_path = target.getAttribute('path')
-      for entry in target.getElementsByTagName('entry'):
-        file = entry.getAttribute('path')
-        wc_status = entry.getElementsByTagName('wc-status')
-        assert len(wc_status) == 1
-        # Emulate svn 1.5 status ouput...
-        statuses = [' ' for i in range(7)]
-        # Col 0
-        xml_item_status = wc_status[0].getAttribute('item')
-        if xml_item_status == 'unversioned':
-          statuses[0] = '?'
-        elif xml_item_status == 'modified':
-          statuses[0] = 'M'
-        elif xml_item_status == 'added':
-          statuses[0] = 'A'
-        elif xml_item_status == 'conflicted':
-          statuses[0] = 'C'
-        elif not xml_item_status:
-          pass
-        else:
-          raise Exception('Unknown item status "%s"; please implement me!' %
-                          xml_item_status)
-        # Col 1
-        xml_props_status = wc_status[0].getAttribute('props')
-        if xml_props_status == 'modified':
-          statuses[1] = 'M'
-        elif xml_props_status == 'conflicted':
-          statuses[1] = 'C'
-        elif (not xml_props_status or xml_props_status == 'none' or
-              xml_props_status == 'normal'):
-          pass
-        else:
-          raise Exception('Unknown props status "%s"; please implement me!' %
-                          xml_props_status)
-        # Col 3
-        if wc_status[0].getAttribute('copied') == 'true':
-          statuses[3] = '+'
-        item = FileStatus(file, statuses[0], statuses[1], statuses[3])
-        results.append(item)
+    for _, entry in ElementTree.iterparse(StringIO(output)):
+      if entry.tag != 'entry':
+        continue
+      file = entry.get('path')
+      wc_status = entry.findall('wc-status')
+      assert len(wc_status) == 1
+      # Emulate svn 1.5 status ouput...
+      statuses = [' ' for i in range(7)]
+      # Col 0
+      xml_item_status = wc_status[0].get('item')
+      if xml_item_status == 'unversioned':
+        statuses[0] = '?'
+      elif xml_item_status == 'modified':
+        statuses[0] = 'M'
+      elif xml_item_status == 'added':
+        statuses[0] = 'A'
+      elif xml_item_status == 'conflicted':
+        statuses[0] = 'C'
+      elif not xml_item_status:
+        pass
+      else:
+        raise Exception('Unknown item status "%s"; please implement me!' %
+                        xml_item_status)
+      # Col 1
+      xml_props_status = wc_status[0].get('props')
+      if xml_props_status == 'modified':
+        statuses[1] = 'M'
+      elif xml_props_status == 'conflicted':
+        statuses[1] = 'C'
+      elif (not xml_props_status or xml_props_status == 'none' or
+            xml_props_status == 'normal'):
+        pass
+      else:
+        raise Exception('Unknown props status "%s"; please implement me!' %
+                        xml_props_status)
+      # Col 3
+      if wc_status[0].get('copied') == 'true':
+        statuses[3] = '+'
+      item = FileStatus(file, statuses[0], statuses[1], statuses[3])
+      results.append(item)
+      entry.clear()
+  except SyntaxError:
+    # Raised by ElementTree for malformed XML.
+    return []
   return results
 
 
@@ -725,51 +1313,58 @@ class SCMWrapper(object):
     Raises:
       Error: if can't get URL for relative path.
     """
+    checkout_path = os.path.join(self._root_dir, self.relpath)
+    # Get the existing scm url and the revision number of the current checkout.
+    # It may already have been fetched along with the other modules, in which
+    # case the checkout is known to exist and not to be a git one.
+    from_info = options.prefetched_svn_info.get(checkout_path)
     # Only update if git is not controlling the directory.
-    git_path = os.path.join(self._root_dir, self.relpath, '.git')
-    if options.path_exists(git_path):
-      print >> options.stdout, (
-          "________ found .git directory; skipping %s" % self.relpath)
+    git_path = os.path.join(checkout_path, '.git')
+    if not from_info and options.path_exists(git_path):
+      print("________ found .git directory; skipping %s" % self.relpath,
+            file=options.stdout)
       return
 
     if args:
       raise Error("Unsupported argument(s): %s" % ",".join(args))
 
     url = self.url
-    components = url.split("@")
+    base_url, url_revision = SplitUrlRevision(url)
     revision = None
     forced_revision = False
     if options.revision:
       # Override the revision number.
-      url = '%s@%s' % (components[0], str(options.revision))
+      url = '%s@%s' % (base_url, str(options.revision))
       revision = int(options.revision)
       forced_revision = True
-    elif len(components) == 2:
-      revision = int(components[1])
+    elif url_revision:
+      revision = int(url_revision)
       forced_revision = True
 
     rev_str = ""
     if revision:
       rev_str = ' at %d' % revision
 
-    if not options.path_exists(os.path.join(self._root_dir, self.relpath)):
+    if not from_info and not options.path_exists(checkout_path):
       # We need to checkout.
-      command = ['checkout', url, os.path.join(self._root_dir, self.relpath)]
+      command = ['checkout', url, checkout_path]
       RunSVNAndGetFileList(options, command, self._root_dir, file_list)
 
-    # Get the existing scm url and the revision number of the current checkout.
-    from_info = CaptureSVNInfo(options,
-                               os.path.join(self._root_dir, self.relpath, '.'),
-                               '.')
+    if not from_info:
+      from_info = CaptureSVNInfo(options, os.path.join(checkout_path, '.'),
+                                 '.')
 
     if options.manually_grab_svn_rev:
       # Retrieve the current HEAD version because svn is slow at null updates.
       if not revision:
-        from_info_live = CaptureSVNInfo(options, from_info.url, '.')
+        from_info_live = options.prefetched_svn_info.get(from_info.url)
+        if not from_info_live:
+          from_info_live = CaptureSVNInfo(options, from_info.url, '.')
         revision = int(from_info_live.revision)
         rev_str = ' at %d' % revision
 
-    if from_info.url != components[0]:
+    # A trailing slash doesn't make it a different url.
+    if from_info.url.rstrip('/') != base_url.rstrip('/'):
       to_info = CaptureSVNInfo(options, url, '.')
       if from_info.root != to_info.root:
         # We have different roots, so check if we can switch --relocate.
@@ -793,11 +1388,15 @@ class SCMWrapper(object):
     # number of the existing directory, then we don't need to bother updating.
     if not options.force and from_info.revision == revision:
       if options.verbose or not forced_revision:
-        print >>options.stdout, ("\n_____ %s%s" % (
-            self.relpath, rev_str))
+        print("\n_____ %s%s" % (self.relpath, rev_str), file=options.stdout)
       return
 
-    command = ["update", os.path.join(self._root_dir, self.relpath)]
+    if options.deferred_updates is not None:
+      # Run together with the other plain updates of this batch of modules.
+      options.deferred_updates.append((revision, checkout_path))
+      return
+
+    command = ["update", checkout_path]
     if revision:
       command.extend(['--revision', str(revision)])
     RunSVNAndGetFileList(options, command, self._root_dir, file_list)
@@ -813,16 +1412,18 @@ class SCMWrapper(object):
       # We can't revert path that doesn't exist.
       # TODO(maruel):  Should we update instead?
       if options.verbose:
-        print >>options.stdout, ("\n_____ %s is missing, can't revert" %
-                                 self.relpath)
+        print("\n_____ %s is missing, can't revert" % self.relpath,
+              file=options.stdout)
       return
 
     files = CaptureSVNStatus(options, path)
+    file_paths = [os.path.join(path, file.path) for file in files]
+    if file_paths:
+      # One write for the whole list rather than one per file.
+      print("\n".join(file_paths), file=options.stdout)
     # Batch the command.
     files_to_revert = []
-    for file in files:
-      file_path = os.path.join(path, file.path)
-      print >>options.stdout, file_path
+    for file, file_path in zip(files, file_paths):
       # Unversioned file or unexpected unversioned file.
       if file.text_status in ('?', '~'):
         # Remove extraneous file. Also remove unexpected unversioned
@@ -846,16 +1447,13 @@ class SCMWrapper(object):
       for p in files_to_revert:
         # Some shell have issues with command lines too long.
         if accumulated_length and accumulated_length + len(p) > 3072:
-          RunSVN(options, command + accumulated_paths,
-                 os.path.join(self._root_dir, self.relpath))
+          RunSVN(options, command + accumulated_paths, path)
           accumulated_paths = []
           accumulated_length = 0
-        else:
-          accumulated_paths.append(p)
-          accumulated_length += len(p)
+        accumulated_paths.append(p)
+        accumulated_length += len(p)
       if accumulated_paths:
-        RunSVN(options, command + accumulated_paths,
-               os.path.join(self._root_dir, self.relpath))
+        RunSVN(options, command + accumulated_paths, path)
 
   def status(self, options, args, file_list):
     """Display status information."""
@@ -881,11 +1479,17 @@ class GClient(object):
     self._config_content = None
     self._config_dict = {}
     self._deps_hooks = []
+    self._parsed_deps = {}
 
   def SetConfig(self, content):
     self._config_dict = {}
     self._config_content = content
-    exec(content, self._config_dict)
+    # A .gclient file normally only assigns literals, see EvalDepsSource.
+    if not EvalDepsSource(content, self._options.config_filename, {},
+                          self._config_dict):
+      self._config_dict = {}
+      exec(CompileCached(content, self._options.config_filename),
+           self._config_dict)
 
   def SaveConfig(self):
     FileWrite(os.path.join(self._root_dir, self._options.config_filename),
@@ -913,12 +1517,20 @@ class GClient(object):
     """
     if not from_dir:
       from_dir = os.curdir
-    path = os.path.realpath(from_dir)
-    while not options.path_exists(os.path.join(path, options.config_filename)):
-      next = os.path.split(path)
-      if not next[1]:
-        return None
-      path = next[0]
+    start_dir = os.path.abspath(from_dir)
+    cache_key = (start_dir, options.config_filename)
+    path = _config_dirs.get(cache_key)
+    if path is None:
+      path = start_dir
+      while not options.path_exists(os.path.join(path,
+                                                 options.config_filename)):
+        parent = os.path.dirname(path)
+        if parent == path:
+          return None
+        path = parent
+      # Only successful lookups are remembered so that a .gclient file created
+      # later in the same process is still found.
+      _config_dirs[cache_key] = path
     client = options.gclient(path, options)
     client._LoadConfig()
     return client
@@ -936,12 +1548,11 @@ class GClient(object):
     Args:
       entries: A sequence of solution names.
     """
-    text = "entries = [\n"
-    for entry in entries:
-      text += "  \"%s\",\n" % entry
-    text += "]\n"
+    lines = ["entries = [\n"]
+    lines.extend("  \"%s\",\n" % entry for entry in entries)
+    lines.append("]\n")
     FileWrite(os.path.join(self._root_dir, self._options.entries_filename),
-              text)
+              "".join(lines))
 
   def _ReadEntries(self):
     """Read the .gclient_entries file for the given client.
@@ -957,7 +1568,11 @@ class GClient(object):
     filename = os.path.join(self._root_dir, self._options.entries_filename)
     if not self._options.path_exists(filename):
       return []
-    exec(FileRead(filename), scope)
+    content = FileRead(filename)
+    # The file is written by _SaveEntries as a single list literal.
+    if not EvalDepsSource(content, filename, {}, scope):
+      scope = {}
+      exec(CompileCached(content, filename), scope)
     return scope["entries"]
 
   class FromImpl:
@@ -998,33 +1613,44 @@ class GClient(object):
     # Skip empty
     if not solution_deps_content:
       return {}
+    # The same DEPS file is usually parsed more than once per run, e.g. once
+    # for the solution and once more for each module that uses From().
+    try:
+      # The values of custom_vars may be lists or dicts, which aren't hashable.
+      cache_key = (solution_name, solution_deps_content,
+                   json.dumps(custom_vars, sort_keys=True),
+                   self._options.deps_os, self._options.platform)
+    except (TypeError, ValueError):
+      cache_key = None
+    if cache_key in self._parsed_deps:
+      deps, hooks = self._parsed_deps[cache_key]
+      # Like a fresh parse, each call queues the hooks of the DEPS file.
+      self._deps_hooks.extend(hooks)
+      return dict(deps)
     # Eval the content
     local_scope = {}
     var = self._VarImpl(custom_vars, local_scope)
-    global_scope = {"From": self.FromImpl, "Var": var.Lookup, "deps_os": {}}
-    exec(solution_deps_content, global_scope, local_scope)
+    functions = {"From": self.FromImpl, "Var": var.Lookup}
+    deps_filename = os.path.join(solution_name, self._options.deps_file)
+    if not EvalDepsSource(solution_deps_content, deps_filename, functions,
+                          local_scope):
+      # The DEPS file does more than assigning values; run it.
+      local_scope.clear()
+      global_scope = dict(functions)
+      global_scope["deps_os"] = {}
+      exec(CompileCached(solution_deps_content, deps_filename), global_scope,
+           local_scope)
     deps = local_scope.get("deps", {})
 
     # load os specific dependencies if defined.  these dependencies may
     # override or extend the values defined by the 'deps' member.
     if "deps_os" in local_scope:
-      deps_os_choices = {
-          "win32": "win",
-          "win": "win",
-          "cygwin": "win",
-          "darwin": "mac",
-          "mac": "mac",
-          "unix": "unix",
-          "linux": "unix",
-          "linux2": "unix",
-         }
-
       if self._options.deps_os is not None:
         deps_to_include = self._options.deps_os.split(",")
         if "all" in deps_to_include:
-          deps_to_include = deps_os_choices.values()
+          deps_to_include = DEPS_OS_CHOICES.values()
       else:
-        deps_to_include = [deps_os_choices.get(self._options.platform, "unix")]
+        deps_to_include = [DEPS_OS_CHOICES.get(self._options.platform, "unix")]
 
       deps_to_include = set(deps_to_include)
       for deps_os_key in deps_to_include:
@@ -1038,8 +1664,8 @@ class GClient(object):
         else:
           deps.update(os_deps)
 
-    if 'hooks' in local_scope:
-      self._deps_hooks.extend(local_scope['hooks'])
+    hooks = local_scope.get('hooks', [])
+    self._deps_hooks.extend(hooks)
 
     # If use_relative_paths is set in the DEPS file, regenerate
     # the dictionary using paths relative to the directory containing
@@ -1050,9 +1676,11 @@ class GClient(object):
         # normpath is required to allow DEPS to use .. in their
         # dependency local path.
         rel_deps[os.path.normpath(os.path.join(solution_name, d))] = url
-      return rel_deps
-    else:
-      return deps
+      deps = rel_deps
+    # Callers modify the returned dict, so hand out copies.
+    if cache_key is not None:
+      self._parsed_deps[cache_key] = (deps, hooks)
+    return dict(deps)
 
   def _ParseAllDeps(self, solution_urls, solution_deps_content):
     """Parse the complete list of dependencies for the client.
@@ -1080,50 +1708,49 @@ class GClient(object):
                               custom_vars)
 
       # If a line is in custom_deps, but not in the solution, we want to append
-      # this line to the solution.
-      if "custom_deps" in solution:
-        for d in solution["custom_deps"]:
-          if d not in solution_deps:
-            solution_deps[d] = solution["custom_deps"][d]
-
-      for d in solution_deps:
-        if "custom_deps" in solution and d in solution["custom_deps"]:
+      # this line to the solution.  Lines in both are overridden.
+      custom_deps = solution.get("custom_deps") or {}
+      solution_deps.update(custom_deps)
+
+      # The scm used to resolve the relative urls of this solution's deps.
+      solution_scm = None
+      for d, url in solution_deps.items():
+        if d in custom_deps:
           # Dependency is overriden.
-          url = solution["custom_deps"][d]
           if url is None:
             continue
         else:
-          url = solution_deps[d]
           # if we have a From reference dependent on another solution, then
           # just skip the From reference. When we pull deps for the solution,
           # we will take care of this dependency.
           #
           # If multiple solutions all have the same From reference, then we
           # should only add one to our list of dependencies.
-          if type(url) != str:
+          if not isinstance(url, str):
             if url.module_name in solution_urls:
               # Already parsed.
               continue
-            if d in deps and type(deps[d]) != str:
-              if url.module_name == deps[d].module_name:
-                continue
+            existing = deps.get(d)
+            if (existing is not None and not isinstance(existing, str) and
+                url.module_name == existing.module_name):
+              continue
           else:
-            parsed_url = urlparse.urlparse(url)
-            scheme = parsed_url[0]
-            if not scheme:
+            if url.startswith("/"):
               # A relative url. Fetch the real base.
-              path = parsed_url[2]
-              if path[0] != "/":
-                raise Error(
-                    "relative DEPS entry \"%s\" must begin with a slash" % d)
               # Create a scm just to query the full url.
-              scm = self._options.scm_wrapper(solution["url"], self._root_dir,
-                                              None)
-              url = scm.FullUrlForRelativeUrl(url)
-        if d in deps and deps[d] != url:
+              if solution_scm is None:
+                solution_scm = self._options.scm_wrapper(solution["url"],
+                                                         self._root_dir, None)
+              url = solution_scm.FullUrlForRelativeUrl(url)
+            elif not urlparse(url)[0]:
+              # Only urls that are neither full nor relative get parsed.
+              raise Error(
+                  "relative DEPS entry \"%s\" must begin with a slash" % d)
+        # A missing entry defaults to url itself, i.e. no conflict.
+        if deps.get(d, url) != url:
           raise Error(
               "Solutions have conflicting versions of dependency \"%s\"" % d)
-        if d in solution_urls and solution_urls[d] != url:
+        if solution_urls.get(d, url) != url:
           raise Error(
               "Dependency \"%s\" conflicts with specified solution" % d)
         # Grab the dependency.
@@ -1180,6 +1807,161 @@ class GClient(object):
         # more matches.
         break
 
+  def _ParseRevisionOverrides(self):
+    """Parses the --revision options into a dict of module name to revision.
+
+    Raises:
+      Error: If a revision has no module name or conflicts with another one.
+    """
+    revision_overrides = {}
+    for revision in self._options.revisions:
+      name, rev = SplitUrlRevision(revision)
+      if rev is None:
+        raise Error(
+            "Specify the full dependency when specifying a revision number.")
+      # Disallow conflicting revs
+      if revision_overrides.get(name, rev) != rev:
+        raise Error(
+            "Conflicting revision numbers specified.")
+      revision_overrides[name] = rev
+    return revision_overrides
+
+  def _PrefetchSVNInfo(self, modules, revision_overrides):
+    """Runs a single 'svn info' for all the existing svn checkouts of modules.
+
+    With --manually_grab_svn_rev, the HEAD revision of the checkouts that
+    aren't pinned to a revision is then fetched with one more 'svn info' on
+    their urls.
+
+    Returns:
+      A dict mapping the path of each checkout, and the url of each HEAD
+      lookup, to its info, as expected in options.prefetched_svn_info.  It is
+      empty when there are fewer than two checkouts, since batching wouldn't
+      save anything then.
+    """
+    if len(modules) < 2:
+      return {}
+    root_dir = self._root_dir.replace('/', os.sep)
+    paths = []
+    modules_by_path = {}
+    for name, url in modules:
+      path = os.path.join(root_dir, name.replace('/', os.sep))
+      if (self._options.path_exists(path) and
+          not self._options.path_exists(os.path.join(path, '.git'))):
+        paths.append(path)
+        modules_by_path[path] = (name, url)
+    if len(paths) < 2:
+      return {}
+    # Checkouts with a readable .svn/wc.db don't start an svn process here.
+    infos = CaptureSVNInfoBatch(self._options, paths, '.')
+    if self._options.manually_grab_svn_rev:
+      head_urls = []
+      for path in paths:
+        if path not in infos:
+          continue
+        info = infos[path]
+        name, url = modules_by_path[path]
+        if (not revision_overrides.get(name) and
+            SplitUrlRevision(url)[1] is None and info.url not in head_urls):
+          head_urls.append(info.url)
+      if len(head_urls) >= 2:
+        infos.update(CaptureSVNInfoBatch(self._options, head_urls, '.'))
+    return infos
+
+  def _RunCommandOnModules(self, command, args, modules, revision_overrides,
+                           file_list):
+    """Runs command on every module, given as a list of (name, url) tuples.
+
+    For updates, 'svn info' is first fetched for all the modules at once.  When
+    run sequentially, the modules that only need a plain 'svn update' are then
+    updated together, see RunSVNUpdates(); the pending updates are run early
+    when a module nested in one of them comes up.
+
+    When --jobs is greater than 1, the modules are spread over worker threads.
+    A module nested inside another one waits for the closest of them to be
+    done, so that a checkout never races with the checkout of its parent
+    directory, while the modules nested in it can then run side by side.  The
+    output of each module is buffered and written out in one piece when it
+    completes so that it doesn't get interleaved.
+    """
+    if command == 'update':
+      self._options.prefetched_svn_info = self._PrefetchSVNInfo(
+          modules, revision_overrides)
+    try:
+      if self._options.jobs <= 1 or len(modules) <= 1:
+        if command == 'update':
+          self._options.deferred_updates = []
+        parents = FindParentPaths([name for name, _ in modules])
+        deferred = set()
+        for name, url in modules:
+          parent = parents[name]
+          while parent is not None and parent not in deferred:
+            parent = parents[parent]
+          if parent is not None:
+            # A checkout is updated before the ones nested in it.
+            RunSVNUpdates(self._options, self._options.deferred_updates,
+                          self._root_dir, file_list)
+            self._options.deferred_updates = []
+            deferred.clear()
+          if command == 'update':
+            pending = len(self._options.deferred_updates)
+          self._options.revision = revision_overrides.get(name)
+          scm = self._options.scm_wrapper(url, self._root_dir, name)
+          scm.RunCommand(command, self._options, args, file_list)
+          self._options.revision = None
+          if (command == 'update' and
+              len(self._options.deferred_updates) > pending):
+            deferred.add(name)
+        if self._options.deferred_updates:
+          RunSVNUpdates(self._options, self._options.deferred_updates,
+                        self._root_dir, file_list)
+        return
+
+      urls = dict(modules)
+      parents = FindParentPaths(urls.keys())
+      done = dict((name, threading.Event()) for name in urls)
+      failed = set()
+      output_lock = threading.Lock()
+
+      def RunModule(name):
+        parent = parents[name]
+        if parent is not None:
+          done[parent].wait()
+        options = copy.copy(self._options)
+        options.stdout = StringIO()
+        options.buffered_output = True
+        module_file_list = []
+        try:
+          if parent in failed:
+            # The error of the parent is the one reported.
+            failed.add(name)
+            return
+          options.revision = revision_overrides.get(name)
+          scm = options.scm_wrapper(urls[name], self._root_dir, name)
+          scm.RunCommand(command, options, args, module_file_list)
+        except Exception:
+          failed.add(name)
+          raise
+        finally:
+          output_lock.acquire()
+          try:
+            output = options.stdout.getvalue()
+            if output:
+              self._options.stdout.write(output)
+            file_list.extend(module_file_list)
+          finally:
+            output_lock.release()
+          done[name].set()
+
+      # A parent sorts before the paths nested in it, so it is always started
+      # before them and nobody waits for a module that isn't running.
+      RunInParallel([lambda name=name: RunModule(name)
+                     for name in sorted(urls)],
+                    self._options.jobs)
+    finally:
+      self._options.prefetched_svn_info = {}
+      self._options.deferred_updates = None
+
   def RunOnDeps(self, command, args):
     """Runs a command on each dependency in a client and its dependencies.
 
@@ -1195,19 +1977,7 @@ class GClient(object):
     if not command in self.supported_commands:
       raise Error("'%s' is an unsupported command" % command)
 
-    # Check for revision overrides.
-    revision_overrides = {}
-    for revision in self._options.revisions:
-      if revision.find("@") == -1:
-        raise Error(
-            "Specify the full dependency when specifying a revision number.")
-      revision_elem = revision.split("@")
-      # Disallow conflicting revs
-      if revision_overrides.has_key(revision_elem[0]) and \
-         revision_overrides[revision_elem[0]] != revision_elem[1]:
-        raise Error(
-            "Conflicting revision numbers specified.")
-      revision_overrides[revision_elem[0]] = revision_elem[1]
+    revision_overrides = self._ParseRevisionOverrides()
 
     solutions = self.GetVar("solutions")
     if not solutions:
@@ -1221,22 +1991,24 @@ class GClient(object):
     entries = {}
     entries_deps_content = {}
     file_list = []
-    # Run on the base solutions first.
+    # Run on the base solutions first.  They must all be done before their
+    # DEPS files can be read.
+    solution_modules = []
     for solution in solutions:
       name = solution["name"]
       if name in entries:
         raise Error("solution %s specified more than once" % name)
       url = solution["url"]
       entries[name] = url
-      if run_scm:
-        self._options.revision = revision_overrides.get(name)
-        scm = self._options.scm_wrapper(url, self._root_dir, name)
-        scm.RunCommand(command, self._options, args, file_list)
-        self._options.revision = None
+      solution_modules.append((name, url))
+    if run_scm:
+      self._RunCommandOnModules(command, args, solution_modules,
+                                revision_overrides, file_list)
+    for name, url in solution_modules:
       try:
         deps_content = FileRead(os.path.join(self._root_dir, name,
                                              self._options.deps_file))
-      except IOError, e:
+      except IOError as e:
         if e.errno != errno.ENOENT:
           raise
         deps_content = ""
@@ -1245,36 +2017,43 @@ class GClient(object):
     # Process the dependencies next (sort alphanumerically to ensure that
     # containing directories get populated first and for readability)
     deps = self._ParseAllDeps(entries, entries_deps_content)
-    deps_to_process = deps.keys()
-    deps_to_process.sort()
-
-    # First pass for direct dependencies.
-    for d in deps_to_process:
-      if type(deps[d]) == str:
-        url = deps[d]
-        entries[d] = url
-        if run_scm:
-          self._options.revision = revision_overrides.get(d)
-          scm = self._options.scm_wrapper(url, self._root_dir, d)
-          scm.RunCommand(command, self._options, args, file_list)
-          self._options.revision = None
 
-    # Second pass for inherited deps (via the From keyword)
-    for d in deps_to_process:
-      if type(deps[d]) != str:
-        sub_deps = self._ParseSolutionDeps(
-                           deps[d].module_name,
-                           FileRead(os.path.join(self._root_dir,
-                                                 deps[d].module_name,
-                                                 self._options.deps_file)),
-                           {})
-        url = sub_deps[d]
+    # Direct dependencies are run first.  Inherited ones (via the From keyword)
+    # come from the DEPS file of a direct dependency, so they are grouped by
+    # that module while at it.
+    direct_deps = []
+    from_modules = []
+    from_deps_by_module = {}
+    for d in sorted(deps):
+      url = deps[d]
+      if isinstance(url, str):
         entries[d] = url
-        if run_scm:
-          self._options.revision = revision_overrides.get(d)
-          scm = self._options.scm_wrapper(url, self._root_dir, d)
-          scm.RunCommand(command, self._options, args, file_list)
-          self._options.revision = None
+        direct_deps.append((d, url))
+      else:
+        if url.module_name not in from_deps_by_module:
+          from_modules.append(url.module_name)
+          from_deps_by_module[url.module_name] = []
+        from_deps_by_module[url.module_name].append(d)
+    if run_scm:
+      self._RunCommandOnModules(command, args, direct_deps, revision_overrides,
+                                file_list)
+
+    # Then the inherited deps, parsing the DEPS file of each module once.
+    from_deps = []
+    for module_name in from_modules:
+      sub_deps = self._ParseSolutionDeps(
+          module_name,
+          FileRead(os.path.join(self._root_dir, module_name,
+                                self._options.deps_file)),
+          {})
+      for d in from_deps_by_module[module_name]:
+        entries[d] = sub_deps[d]
+        from_deps.append((d, sub_deps[d]))
+    # Keep containing directories first.
+    from_deps.sort()
+    if run_scm:
+      self._RunCommandOnModules(command, args, from_deps, revision_overrides,
+                                file_list)
 
     is_using_git = IsUsingGit(self._root_dir, entries.keys())
     self._RunHooks(command, file_list, is_using_git)
@@ -1284,20 +2063,29 @@ class GClient(object):
       # TODO(darin): we should delete this directory manually if it doesn't
       # have any changes in it.
       prev_entries = self._ReadEntries()
-      for entry in prev_entries:
+      # Parents sort before their children, so entries inside a directory
+      # deleted here don't need to be looked at.
+      deleted = []
+      for entry in sorted(prev_entries):
+        if entry in entries:
+          continue
+        if [d for d in deleted if entry.startswith(d + '/')]:
+          continue
         e_dir = os.path.join(self._root_dir, entry)
-        if entry not in entries and self._options.path_exists(e_dir):
+        if self._options.path_exists(e_dir):
           if CaptureSVNStatus(self._options, e_dir):
             # There are modified files in this entry
             entries[entry] = None  # Keep warning until removed.
-            print >> self._options.stdout, (
-                "\nWARNING: \"%s\" is no longer part of this client.  "
-                "It is recommended that you manually remove it.\n") % entry
+            print(("\nWARNING: \"%s\" is no longer part of this client.  "
+                   "It is recommended that you manually remove it.\n") % entry,
+                  file=self._options.stdout)
           else:
             # Delete the entry
-            print >> self._options.stdout, ("\n________ deleting \'%s\' " +
-                "in \'%s\'") % (entry, self._root_dir)
+            print(("\n________ deleting \'%s\' " +
+                   "in \'%s\'") % (entry, self._root_dir),
+                  file=self._options.stdout)
             RemoveDirectory(e_dir)
+            deleted.append(entry)
       # record the current list of entries for next time
       self._SaveEntries(entries)
 
@@ -1316,19 +2104,7 @@ class GClient(object):
     Raises:
       Error: If the client has conflicting entries.
     """
-    # Check for revision overrides.
-    revision_overrides = {}
-    for revision in self._options.revisions:
-      if revision.find("@") < 0:
-        raise Error(
-            "Specify the full dependency when specifying a revision number.")
-      revision_elem = revision.split("@")
-      # Disallow conflicting revs
-      if revision_overrides.has_key(revision_elem[0]) and \
-         revision_overrides[revision_elem[0]] != revision_elem[1]:
-        raise Error(
-            "Conflicting revision numbers specified.")
-      revision_overrides[revision_elem[0]] = revision_elem[1]
+    revision_overrides = self._ParseRevisionOverrides()
 
     solutions = self.GetVar("solutions")
     if not solutions:
@@ -1340,19 +2116,14 @@ class GClient(object):
     # Inner helper to generate base url and rev tuple (including honoring
     # |revision_overrides|)
     def GetURLAndRev(name, original_url):
-      if original_url.find("@") < 0:
-        if revision_overrides.has_key(name):
-          return (original_url, int(revision_overrides[name]))
-        else:
-          # TODO(aharper): SVN/SCMWrapper cleanup (non-local commandset)
-          return (original_url, CaptureSVNHeadRevision(self._options,
-                                                       original_url))
+      url, rev = SplitUrlRevision(original_url)
+      if name in revision_overrides:
+        return (url, int(revision_overrides[name]))
+      elif rev is None:
+        # TODO(aharper): SVN/SCMWrapper cleanup (non-local commandset)
+        return (url, CaptureSVNHeadRevision(self._options, url))
       else:
-        url_components = original_url.split("@")
-        if revision_overrides.has_key(name):
-          return (url_components[0], int(revision_overrides[name]))
-        else:
-          return (url_components[0], int(url_components[1]))
+        return (url, int(rev))
 
     # Run on the base solutions first.
     for solution in solutions:
@@ -1373,40 +2144,39 @@ class GClient(object):
     # Process the dependencies next (sort alphanumerically to ensure that
     # containing directories get populated first and for readability)
     deps = self._ParseAllDeps(entries, entries_deps_content)
-    deps_to_process = deps.keys()
-    deps_to_process.sort()
+    deps_to_process = sorted(deps)
 
     # First pass for direct dependencies.
     for d in deps_to_process:
-      if type(deps[d]) == str:
+      if isinstance(deps[d], str):
         (url, rev) = GetURLAndRev(d, deps[d])
         entries[d] = "%s@%d" % (url, rev)
 
-    # Second pass for inherited deps (via the From keyword)
+    # Second pass for inherited deps (via the From keyword).  Several deps
+    # usually come from the same module, so only fetch its DEPS file once.
+    sub_deps_by_module = {}
     for d in deps_to_process:
-      if type(deps[d]) != str:
-        deps_parent_url = entries[deps[d].module_name]
-        if deps_parent_url.find("@") < 0:
-          raise Error("From %s missing revisioned url" % deps[d].module_name)
-        deps_parent_url_components = deps_parent_url.split("@")
-        # TODO(aharper): SVN/SCMWrapper cleanup (non-local commandset)
-        deps_parent_content = CaptureSVN(
-                                self._options,
-                                ["cat",
-                                 "%s/%s@%s" % (deps_parent_url_components[0],
-                                               self._options.deps_file,
-                                               deps_parent_url_components[1])],
-                                os.getcwd())
-        sub_deps = self._ParseSolutionDeps(
-                           deps[d].module_name,
-                           FileRead(os.path.join(self._root_dir,
-                                                 deps[d].module_name,
-                                                 self._options.deps_file)),
-                           {})
-        (url, rev) = GetURLAndRev(d, sub_deps[d])
+      if not isinstance(deps[d], str):
+        module_name = deps[d].module_name
+        if module_name not in sub_deps_by_module:
+          deps_parent_url, deps_parent_rev = SplitUrlRevision(
+              entries[module_name])
+          if deps_parent_rev is None:
+            raise Error("From %s missing revisioned url" % module_name)
+          # TODO(aharper): SVN/SCMWrapper cleanup (non-local commandset)
+          deps_parent_content = CaptureSVN(
+                                  self._options,
+                                  ["cat",
+                                   "%s/%s@%s" % (deps_parent_url,
+                                                 self._options.deps_file,
+                                                 deps_parent_rev)],
+                                  os.getcwd())
+          sub_deps_by_module[module_name] = self._ParseSolutionDeps(
+              module_name, deps_parent_content, {})
+        (url, rev) = GetURLAndRev(d, sub_deps_by_module[module_name][d])
         entries[d] = "%s@%d" % (url, rev)
 
-    print ";".join(["%s,%s" % (x, entries[x]) for x in sorted(entries.keys())])
+    print(";".join(["%s,%s" % (x, entries[x]) for x in sorted(entries)]))
 
 
 ## gclient commands.
@@ -1424,7 +2194,7 @@ def DoCleanup(options, args):
   if options.verbose:
     # Print out the .gclient file.  This is longer than if we just printed the
     # client dict, but more legible, and it might contain helpful comments.
-    print >>options.stdout, client.ConfigContent()
+    print(client.ConfigContent(), file=options.stdout)
   options.verbose = True
   return client.RunOnDeps('cleanup', args)
 
@@ -1466,8 +2236,11 @@ def DoHelp(options, args):
   Raises:
     Error: if the command is unknown.
   """
-  if len(args) == 1 and args[0] in COMMAND_USAGE_TEXT:
-    print >>options.stdout, COMMAND_USAGE_TEXT[args[0]]
+  usage = None
+  if len(args) == 1:
+    usage = GetCommandUsage(args[0])
+  if usage:
+    print(usage, file=options.stdout)
   else:
     raise Error("unknown subcommand '%s'; see 'gclient help'" % args[0])
 
@@ -1484,7 +2257,7 @@ def DoStatus(options, args):
   if options.verbose:
     # Print out the .gclient file.  This is longer than if we just printed the
     # client dict, but more legible, and it might contain helpful comments.
-    print >>options.stdout, client.ConfigContent()
+    print(client.ConfigContent(), file=options.stdout)
   options.verbose = True
   return client.RunOnDeps('status', args)
 
@@ -1509,21 +2282,19 @@ def DoUpdate(options, args):
           # something that was explicitly passed
           has_key = False
           for r in options.revisions:
-            if r.split('@')[0] == s['name']:
+            if SplitUrlRevision(r)[0] == s['name']:
               has_key = True
               break
 
           if not has_key:
-            handle = urllib.urlopen(s['safesync_url'])
-            rev = handle.read().strip()
-            handle.close()
+            rev = str(UrlRead(s['safesync_url']).strip())
             if len(rev):
               options.revisions.append(s['name']+'@'+rev)
 
   if options.verbose:
     # Print out the .gclient file.  This is longer than if we just printed the
     # client dict, but more legible, and it might contain helpful comments.
-    print >>options.stdout, client.ConfigContent()
+    print(client.ConfigContent(), file=options.stdout)
   return client.RunOnDeps('update', args)
 
 
@@ -1539,7 +2310,7 @@ def DoDiff(options, args):
   if options.verbose:
     # Print out the .gclient file.  This is longer than if we just printed the
     # client dict, but more legible, and it might contain helpful comments.
-    print >>options.stdout, client.ConfigContent()
+    print(client.ConfigContent(), file=options.stdout)
   options.verbose = True
   return client.RunOnDeps('diff', args)
 
@@ -1568,7 +2339,7 @@ def DoRunHooks(options, args):
   if options.verbose:
     # Print out the .gclient file.  This is longer than if we just printed the
     # client dict, but more legible, and it might contain helpful comments.
-    print >>options.stdout, client.ConfigContent()
+    print(client.ConfigContent(), file=options.stdout)
   return client.RunOnDeps('runhooks', args)
 
 
@@ -1638,9 +2409,19 @@ def Main(argv):
                            default=False,
                            help="Skip svn up whenever possible by requesting "
                                 "actual HEAD revision from the repository")
+  option_parser.add_option("", "--pysvn", action="store_true", default=False,
+                           dest="use_pysvn",
+                           help=("get svn info through the pysvn bindings "
+                                 "when they're installed; svn is still used "
+                                 "when pysvn fails, e.g. to ask for a "
+                                 "password"))
   option_parser.add_option("", "--head", action="store_true", default=False,
                            help=("skips any safesync_urls specified in "
                                  "configured solutions"))
+  option_parser.add_option("", "--jobs", type="int", default=1,
+                           metavar="N",
+                           help=("run up to N svn commands in parallel; their "
+                                 "output is shown once each one completes"))
 
   if len(argv) < 2:
     # Users don't need to be told to use the 'help' command.
@@ -1666,6 +2447,15 @@ def Main(argv):
   options.config_filename = os.environ.get("GCLIENT_FILE", ".gclient")
   options.entries_filename = ".gclient_entries"
   options.deps_file = "DEPS"
+  # 'svn info' results fetched ahead of time for a batch of modules, keyed by
+  # the path of the checkout.
+  options.prefetched_svn_info = {}
+  # The plain 'svn update's of a batch of modules, run once they have all been
+  # looked at; None when updates are run right away.
+  options.deferred_updates = None
+  # Whether options.stdout is only shown once a command is done, so that svn
+  # can't prompt for anything through it.
+  options.buffered_output = False
 
   # These are overridded when testing. They are not externally visible.
   options.stdout = sys.stdout
@@ -1679,8 +2469,8 @@ def Main(argv):
 if "__main__" == __name__:
   try:
     result = Main(sys.argv)
-  except Error, e:
-    print "Error: %s" % str(e)
+  except Error as e:
+    print("Error: %s" % str(e))
     result = 1
   sys.exit(result)
 
@@ -16,21 +16,30 @@
 
 """Unit tests for gclient.py."""
 
+from __future__ import print_function
+
 __author__ = 'stephen5.ng@gmail.com (Stephen Ng)'
 
-import __builtin__
 import copy
+import itertools
 import os
 import random
+import shutil
+import sqlite3
 import string
 import subprocess
 import sys
+import tempfile
 import unittest
 
-directory, _file = os.path.split(__file__)
-if directory:
-  directory += os.sep
-sys.path.append(os.path.abspath(directory + '../pymox'))
+# Python 3 moved these.
+try:
+  from cStringIO import StringIO
+except ImportError:
+  from io import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'pymox'))
 
 import gclient
 import mox
@@ -39,13 +48,23 @@ import mox
 ## Some utilities for generating arbitrary arguments.
 
 
+# Maps a length to an endless iterator over random strings of that length.
+# Strings are drawn from a pool since generating them letter by letter is
+# the most expensive part of setting up a test.
+_STRING_POOL = {}
+
+
 def String(max_length):
-  return ''.join([random.choice(string.letters)
-                  for x in xrange(random.randint(1, max_length))])
+  length = random.randint(1, max_length)
+  if length not in _STRING_POOL:
+    _STRING_POOL[length] = itertools.cycle(
+        [''.join([random.choice(string.ascii_letters) for x in range(length)])
+         for y in range(64)])
+  return next(_STRING_POOL[length])
 
 
 def Strings(max_arg_count, max_arg_length):
-  return [String(max_arg_length) for x in xrange(max_arg_count)]
+  return [String(max_arg_length) for x in range(max_arg_count)]
 
 
 def Args(max_arg_count=8, max_arg_length=16):
@@ -67,28 +86,108 @@ def RootDir(max_elt_count=4, max_elt_length=8):
   return os.sep + _DirElts(max_elt_count, max_elt_length)
 
 
+class CachedMockObject(mox.MockObject):
+  """A mox.MockObject that only introspects each mocked object once.
+
+  Mocking a module like os means looking at every one of its attributes, and
+  each test case mocks several of them.
+  """
+  # Maps a mocked object to its (methods, vars, description).
+  _members = {}
+
+  def __init__(self, class_to_mock, attrs={}):
+    members = None
+    if not attrs:
+      members = self._members.get(class_to_mock)
+    if members is None:
+      mox.MockObject.__init__(self, class_to_mock, attrs)
+      if not attrs:
+        self._members[class_to_mock] = (
+            frozenset(self._known_methods), frozenset(self._known_vars),
+            self._description)
+      return
+    mox.MockAnything.__dict__['__init__'](self)
+    methods, known_vars, description = members
+    self._known_methods = set(methods)
+    self._known_vars = set(known_vars)
+    self._class_to_mock = class_to_mock
+    self._description = description
+
+
+class CachedMox(mox.Mox):
+  """A mox.Mox creating CachedMockObject mocks.
+
+  A single instance is reused by all the tests of a class; call Reset() before
+  each test.
+  """
+  def CreateMock(self, class_to_mock, attrs={}):
+    new_mock = CachedMockObject(class_to_mock, attrs=attrs)
+    self._mock_objects.append(new_mock)
+    return new_mock
+
+  def Reset(self):
+    """Forgets the mocks created by the previous test."""
+    self.UnsetStubs()
+    self._mock_objects = []
+
+
+def _CheckMoxInternals():
+  """Fails clearly if mox lacks the internals the two classes above rely on.
+
+  mox has no public way to reuse what a MockObject learned about the object it
+  mocks, so CachedMockObject sets the attributes of MockObject.__init__
+  itself, and CachedMox resets the list of mocks of mox.Mox.  pymox 0.5.3 and
+  0.7.x have them.
+  """
+  mock_vars = vars(mox.MockObject(CachedMockObject))
+  missing = [name for name in ('_known_methods', '_known_vars',
+                               '_class_to_mock', '_description')
+             if name not in mock_vars]
+  if '_mock_objects' not in vars(mox.Mox()):
+    missing.append('Mox._mock_objects')
+  if missing:
+    raise AssertionError(
+        'This version of mox (%s) is not supported by CachedMox, it has no %s;'
+        ' use pymox 0.5.3 or 0.7.x.' % (mox.__file__, ', '.join(missing)))
+
+_CheckMoxInternals()
+
+
 class BaseTestCase(unittest.TestCase):
   # Like unittest's assertRaises, but checks for Gclient.Error.
   def assertRaisesError(self, msg, fn, *args, **kwargs):
-    try:
+    with self.assertRaises(gclient.Error) as cm:
       fn(*args, **kwargs)
-    except gclient.Error, e:
-      self.assertEquals(e.args[0], msg)
-    else:
-      self.fail('%s not raised' % msg)
+    self.assertEquals(cm.exception.args[0], msg)
+
+  # Records the two writes gclient's print() makes: the text, then a newline.
+  def ExpectPrint(self, stream, text):
+    stream.write(text)
+    stream.write('\n')
 
   def Options(self, *args, **kwargs):
     return self.OptionsObject(self, *args, **kwargs)
 
+  @classmethod
+  def setUpClass(cls):
+    cls._mox = CachedMox()
+
   def setUp(self):
-    self.mox = mox.Mox()
+    self.mox = self._mox
+    self.mox.Reset()
+    # Don't let a .gclient lookup from an earlier test be reused.
+    gclient._config_dirs.clear()
     # Mock them to be sure nothing bad happens.
     self._CaptureSVN = gclient.CaptureSVN
     gclient.CaptureSVN = self.mox.CreateMockAnything()
     self._CaptureSVNInfo = gclient.CaptureSVNInfo
     gclient.CaptureSVNInfo = self.mox.CreateMockAnything()
+    self._CaptureSVNInfoBatch = gclient.CaptureSVNInfoBatch
+    gclient.CaptureSVNInfoBatch = self.mox.CreateMockAnything()
     self._CaptureSVNStatus = gclient.CaptureSVNStatus
     gclient.CaptureSVNStatus = self.mox.CreateMockAnything()
+    self._ReadSVNWorkingCopyInfo = gclient.ReadSVNWorkingCopyInfo
+    gclient.ReadSVNWorkingCopyInfo = self.mox.CreateMockAnything()
     self._FileRead = gclient.FileRead
     gclient.FileRead = self.mox.CreateMockAnything()
     self._FileWrite = gclient.FileWrite
@@ -106,11 +205,17 @@ class BaseTestCase(unittest.TestCase):
     gclient.sys = self.mox.CreateMock(sys)
     self._subprocess = gclient.subprocess
     gclient.subprocess = self.mox.CreateMock(subprocess)
+    # Whether or not the bindings are installed, svn is mocked.
+    self._pysvn = gclient.pysvn
+    gclient.pysvn = False
 
   def tearDown(self):
+    self.mox.UnsetStubs()
     gclient.CaptureSVN = self._CaptureSVN
     gclient.CaptureSVNInfo = self._CaptureSVNInfo
+    gclient.CaptureSVNInfoBatch = self._CaptureSVNInfoBatch
     gclient.CaptureSVNStatus = self._CaptureSVNStatus
+    gclient.ReadSVNWorkingCopyInfo = self._ReadSVNWorkingCopyInfo
     gclient.FileRead = self._FileRead
     gclient.FileWrite = self._FileWrite
     gclient.RemoveDirectory = self._RemoveDirectory
@@ -120,10 +225,19 @@ class BaseTestCase(unittest.TestCase):
     gclient.os = self._os
     gclient.sys = self._sys
     gclient.subprocess = self._subprocess
+    gclient.pysvn = self._pysvn
 
 
 class GclientTestCase(BaseTestCase):
   class OptionsObject(object):
+    # Keeps the per-test options objects small; revision is set by gclient.
+    __slots__ = ('verbose', 'spec', 'config_filename', 'entries_filename',
+                 'deps_file', 'force', 'revisions', 'revision',
+                 'manually_grab_svn_rev', 'deps_os', 'head', 'jobs',
+                 'use_pysvn', 'prefetched_svn_info', 'deferred_updates',
+                 'buffered_output', 'stdout', 'path_exists', 'platform',
+                 'gclient', 'scm_wrapper')
+
     def __init__(self, test_case, verbose=False, spec=None,
                  config_filename='a_file_name',
                  entries_filename='a_entry_file_name',
@@ -138,6 +252,11 @@ class GclientTestCase(BaseTestCase):
       self.manually_grab_svn_rev = True
       self.deps_os = None
       self.head = False
+      self.jobs = 1
+      self.use_pysvn = False
+      self.prefetched_svn_info = {}
+      self.deferred_updates = None
+      self.buffered_output = False
 
       # Mox
       self.stdout = test_case.stdout
@@ -146,6 +265,15 @@ class GclientTestCase(BaseTestCase):
       self.gclient = test_case.gclient
       self.scm_wrapper = test_case.scm_wrapper
 
+  @classmethod
+  def setUpClass(cls):
+    super(GclientTestCase, cls).setUpClass()
+    # Any values will do and no test modifies them, so they are shared by the
+    # tests of a class.
+    cls._args = Args()
+    cls._root_dir = Dir()
+    cls._url = Url()
+
   def setUp(self):
     BaseTestCase.setUp(self)
     self.stdout = self.mox.CreateMock(sys.stdout)
@@ -158,9 +286,9 @@ class GclientTestCase(BaseTestCase):
     self.gclient = self.mox.CreateMock(gclient.GClient)
     self.scm_wrapper = self.mox.CreateMock(gclient.SCMWrapper)
 
-    self.args = Args()
-    self.root_dir = Dir()
-    self.url = Url()
+    self.args = self._args
+    self.root_dir = self._root_dir
+    self.url = self._url
 
 
 class GClientCommandsTestCase(BaseTestCase):
@@ -168,12 +296,27 @@ class GClientCommandsTestCase(BaseTestCase):
     known_commands = [gclient.DoCleanup, gclient.DoConfig, gclient.DoDiff,
                       gclient.DoHelp, gclient.DoStatus, gclient.DoUpdate,
                       gclient.DoRevert, gclient.DoRunHooks, gclient.DoRevInfo]
-    for (k,v) in gclient.gclient_command_map.iteritems():
+    for (k,v) in gclient.gclient_command_map.items():
       # If it fails, you need to add a test case for the new command.
       self.assert_(v in known_commands)
     self.mox.ReplayAll()
     self.mox.VerifyAll()
 
+  def testDispatchCommand(self):
+    options = object()
+    args = Args()
+    command_map = {'diff': self.mox.CreateMockAnything(),
+                   'update': self.mox.CreateMockAnything()}
+    command_map['update'](options, args).AndReturn(42)
+
+    self.mox.ReplayAll()
+    self.assertEqual(
+        gclient.DispatchCommand('update', options, args, command_map), 42)
+    self.assertRaisesError("unknown subcommand 'speak'; see 'gclient help'",
+                           gclient.DispatchCommand, 'speak', options, args,
+                           command_map)
+    self.mox.VerifyAll()
+
 class TestDoConfig(GclientTestCase):
   def setUp(self):
     GclientTestCase.setUp(self)
@@ -225,12 +368,23 @@ class TestDoConfig(GclientTestCase):
 class TestDoHelp(GclientTestCase):
   def testGetUsage(self):
     options = self.Options()
-    print >> options.stdout, gclient.COMMAND_USAGE_TEXT['config']
+    self.ExpectPrint(options.stdout, gclient.COMMAND_USAGE_TEXT['config'])
 
     self.mox.ReplayAll()
     gclient.DoHelp(options, ('config',))
     self.mox.VerifyAll()
 
+  def testGetUsageSync(self):
+    options = self.Options()
+    self.ExpectPrint(options.stdout, gclient.GetCommandUsage('sync'))
+
+    self.mox.ReplayAll()
+    gclient.DoHelp(options, ('sync',))
+    self.mox.VerifyAll()
+    self.assertTrue(gclient.GetCommandUsage('sync').startswith(
+        'Perform a checkout/update'))
+    self.assertTrue('usage: gclient sync' in gclient.GetCommandUsage('sync'))
+
   def testTooManyArgs(self):
     options = self.Options()
     self.mox.ReplayAll()
@@ -269,16 +423,18 @@ class GenericCommandTestCase(GclientTestCase):
     self.mox.VerifyAll()
 
   def Verbose(self, command, function):
+    # Only the printed config is of interest; no need to mock a whole file.
+    self.stdout = StringIO()
     options = self.Options(verbose=True)
     self.gclient.LoadCurrentConfig(options).AndReturn(self.gclient)
     text = "# Dummy content\nclient = 'my client'"
     self.gclient.ConfigContent().AndReturn(text)
-    print >>self.stdout, text
     self.gclient.RunOnDeps(command, self.args).AndReturn(0)
 
     self.mox.ReplayAll()
     result = function(options, self.args)
     self.assertEquals(result, 0)
+    self.assertEquals(self.stdout.getvalue(), text + '\n')
     self.mox.VerifyAll()
 
 class TestDoCleanup(GenericCommandTestCase):
@@ -326,22 +482,21 @@ class TestDoUpdate(GenericCommandTestCase):
     self.mox.VerifyAll()
 
   def Verbose(self, command, function):
+    # Only the printed config is of interest; no need to mock a whole file.
+    self.stdout = StringIO()
     options = self.Options(verbose=True)
     self.gclient.LoadCurrentConfig(options).AndReturn(self.gclient)
     self.gclient.GetVar("solutions")
     text = "# Dummy content\nclient = 'my client'"
     self.gclient.ConfigContent().AndReturn(text)
-    print >>self.stdout, text
     self.gclient.RunOnDeps(command, self.args).AndReturn(0)
 
     self.mox.ReplayAll()
     result = function(options, self.args)
     self.assertEquals(result, 0)
+    self.assertEquals(self.stdout.getvalue(), text + '\n')
     self.mox.VerifyAll()
 
-  def Options(self, verbose=False, *args, **kwargs):
-    return self.OptionsObject(self, verbose=verbose, *args, **kwargs)
-
   def testBasic(self):
     self.ReturnValue('update', gclient.DoUpdate, 0)
   def testError(self):
@@ -353,9 +508,6 @@ class TestDoUpdate(GenericCommandTestCase):
 
 
 class TestDoDiff(GenericCommandTestCase):
-  def Options(self, *args, **kwargs):
-      return self.OptionsObject(self, *args, **kwargs)
-
   def testBasic(self):
     self.ReturnValue('diff', gclient.DoDiff, 0)
   def testError(self):
@@ -376,12 +528,42 @@ class TestDoRevert(GenericCommandTestCase):
 
 
 class GClientClassTestCase(GclientTestCase):
+  # .gclient content with a single solution; see _SolutionConfig().
+  _SOLUTION_CONFIG = """solutions = [ {
+  'name': '%s',
+  'url': '%s',
+  'custom_deps': {},%s
+}, ]"""
+
+  def _SolutionConfig(self, name, custom_vars=None):
+    """Returns the .gclient content of a single solution checked out from
+    self.url."""
+    custom_vars_line = ''
+    if custom_vars is not None:
+      custom_vars_line = "\n  'custom_vars': %r," % custom_vars
+    return self._SOLUTION_CONFIG % (name, self.url, custom_vars_line)
+
+  def _ExpectEntries(self, options, entries_content):
+    """Records that there are no previous entries and what gets saved."""
+    entries_file = os.path.join(self.root_dir, options.entries_filename)
+    options.path_exists(entries_file).AndReturn(False)
+    # The entries come out of a dict, whose order differs between Pythons.
+    expected_lines = sorted(entries_content.splitlines())
+    gclient.FileWrite(entries_file, mox.Func(
+        lambda content: sorted(content.splitlines()) == expected_lines))
+
+  def _ExpectDepsFile(self, options, name, deps_content):
+    """Records the read of the DEPS file of the checkout name."""
+    gclient.FileRead(os.path.join(self.root_dir, name, options.deps_file)
+        ).AndReturn(deps_content)
+
   def testDir(self):
     members = ['ConfigContent', 'FromImpl', '_VarImpl', '_ParseAllDeps',
       '_ParseSolutionDeps', 'GetVar', '_LoadConfig', 'LoadCurrentConfig',
-      '_ReadEntries', '_RunHookAction', '_RunHooks', 'RunOnDeps', 'SaveConfig',
-      '_SaveEntries', 'SetConfig', 'SetDefaultConfig', 'supported_commands',
-      'PrintRevInfo']
+      '_ParseRevisionOverrides', '_PrefetchSVNInfo', '_ReadEntries',
+      '_RunCommandOnModules', '_RunHookAction', '_RunHooks', 'RunOnDeps',
+      'SaveConfig', '_SaveEntries', 'SetConfig', 'SetDefaultConfig',
+      'supported_commands', 'PrintRevInfo']
 
     # If you add a member, be sure to add the relevant test!
     actual_members = [x for x in sorted(dir(gclient.GClient))
@@ -420,13 +602,16 @@ class GClientClassTestCase(GclientTestCase):
     }]
     self.assertEqual(client.GetVar('solutions'), solutions)
     self.assertEqual(client.GetVar('foo'), None)
+    # Anything beyond plain assignments is still run as Python.
+    client.SetConfig("import os\nclient = os.path.join('my', 'client')")
+    self.assertEqual(client.GetVar('client'), os.path.join('my', 'client'))
     self.mox.VerifyAll()
 
   def testLoadCurrentConfig(self):
     # pymox has trouble to mock the class object and not a class instance.
     self.gclient = self.mox.CreateMockAnything()
     options = self.Options()
-    path = os.path.realpath(self.root_dir)
+    path = os.path.abspath(self.root_dir)
     options.path_exists(os.path.join(path, options.config_filename)
         ).AndReturn(True)
     options.gclient(path, options).AndReturn(options.gclient)
@@ -436,6 +621,25 @@ class GClientClassTestCase(GclientTestCase):
     client = gclient.GClient.LoadCurrentConfig(options, self.root_dir)
     self.mox.VerifyAll()
 
+  def testLoadCurrentConfigCached(self):
+    # The upward search for the config file only happens once per directory.
+    self.gclient = self.mox.CreateMockAnything()
+    options = self.Options()
+    path = os.path.join(os.path.abspath(self.root_dir), 'src')
+    from_dir = os.path.join(path, 'sub')
+    options.path_exists(os.path.join(from_dir, options.config_filename)
+        ).AndReturn(False)
+    options.path_exists(os.path.join(path, options.config_filename)
+        ).AndReturn(True)
+    for i in range(2):
+      options.gclient(path, options).AndReturn(options.gclient)
+      options.gclient._LoadConfig()
+
+    self.mox.ReplayAll()
+    gclient.GClient.LoadCurrentConfig(options, from_dir)
+    gclient.GClient.LoadCurrentConfig(options, from_dir)
+    self.mox.VerifyAll()
+
   def testRunOnDepsNoDeps(self):
     solution_name = 'testRunOnDepsNoDeps_solution_name'
     gclient_config = (
@@ -457,9 +661,9 @@ class GClientClassTestCase(GclientTestCase):
 
     options = self.Options()
 
-    # Expect a check for the entries file and we say there is not one.
-    options.path_exists(os.path.join(self.root_dir, options.entries_filename)
-        ).AndReturn(False)
+    # Expect a check for the entries file and we say there is not one, then
+    # the entries file written after everything is done.
+    self._ExpectEntries(options, entries_content)
 
     # An scm will be requested for the solution.
     options.scm_wrapper(self.url, self.root_dir, solution_name
@@ -471,11 +675,6 @@ class GClientClassTestCase(GclientTestCase):
                      solution_name,
                      options.deps_file)).AndRaise(IOError(2, 'No DEPS file'))
 
-    # After everything is done, an attempt is made to write an entries
-    # file.
-    gclient.FileWrite(os.path.join(self.root_dir, options.entries_filename),
-        entries_content)
-
     self.mox.ReplayAll()
     client = gclient.GClient(self.root_dir, options)
     client.SetConfig(gclient_config)
@@ -511,9 +710,9 @@ class GClientClassTestCase(GclientTestCase):
 
     options = self.Options()
 
-    # Expect a check for the entries file and we say there is not one.
-    options.path_exists(os.path.join(self.root_dir, options.entries_filename)
-        ).AndReturn(False)
+    # Expect a check for the entries file and we say there is not one, then
+    # the entries file written after everything is done.
+    self._ExpectEntries(options, entries_content)
 
     # An scm will be requested for the solution.
     options.scm_wrapper(self.url, self.root_dir, solution_name
@@ -521,9 +720,7 @@ class GClientClassTestCase(GclientTestCase):
     # Then an update will be performed.
     scm_wrapper_sol.RunCommand('update', options, self.args, [])
     # Then an attempt will be made to read its DEPS file.
-    gclient.FileRead(os.path.join(self.root_dir,
-                     solution_name,
-                     options.deps_file)).AndReturn(deps)
+    self._ExpectDepsFile(options, solution_name, deps)
 
     # Next we expect an scm to be request for dep src/t but it should
     # use the url specified in deps and the relative path should now
@@ -534,11 +731,6 @@ class GClientClassTestCase(GclientTestCase):
         os.path.join(solution_name, "src", "t")).AndReturn(scm_wrapper_t)
     scm_wrapper_t.RunCommand('update', options, self.args, [])
 
-    # After everything is done, an attempt is made to write an entries
-    # file.
-    gclient.FileWrite(os.path.join(self.root_dir, options.entries_filename),
-        entries_content)
-
     self.mox.ReplayAll()
     client = gclient.GClient(self.root_dir, options)
     client.SetConfig(gclient_config)
@@ -580,19 +772,18 @@ class GClientClassTestCase(GclientTestCase):
 
     options = self.Options()
 
-    # Expect a check for the entries file and we say there is not one.
-    options.path_exists(os.path.join(self.root_dir, options.entries_filename)
-        ).AndReturn(False)
-
     # An scm will be requested for the solution.
     options.scm_wrapper(self.url, self.root_dir, solution_name
         ).AndReturn(scm_wrapper_sol)
     # Then an update will be performed.
     scm_wrapper_sol.RunCommand('update', options, self.args, [])
     # Then an attempt will be made to read its DEPS file.
-    gclient.FileRead(os.path.join(self.root_dir,
-                     solution_name,
-                     options.deps_file)).AndReturn(deps)
+    self._ExpectDepsFile(options, solution_name, deps)
+
+    # Before updating the deps, their existing checkouts are looked for to
+    # fetch all their 'svn info' at once.  There are none.
+    options.path_exists(os.path.join(self.root_dir, 'src/n')).AndReturn(False)
+    options.path_exists(os.path.join(self.root_dir, 'src/t')).AndReturn(False)
 
     # Next we expect an scm to be request for dep src/n even though it does not
     # exist in the DEPS file.
@@ -611,10 +802,9 @@ class GClientClassTestCase(GclientTestCase):
 
     # NOTE: the dep src/b should not create an scm at all.
 
-    # After everything is done, an attempt is made to write an entries
-    # file.
-    gclient.FileWrite(os.path.join(self.root_dir, options.entries_filename),
-        entries_content)
+    # Expect a check for the entries file and we say there is not one, then
+    # the entries file written after everything is done.
+    self._ExpectEntries(options, entries_content)
 
     self.mox.ReplayAll()
     client = gclient.GClient(self.root_dir, options)
@@ -662,16 +852,25 @@ class GClientClassTestCase(GclientTestCase):
 
     options = self.Options()
 
-    # Expect a check for the entries file and we say there is not one.
-    options.path_exists(os.path.join(self.root_dir, options.entries_filename)
-        ).AndReturn(False)
+    # Both solutions are already checked out so their 'svn info' is fetched
+    # in one go.
+    path_a = os.path.join(self.root_dir, name_a)
+    path_b = os.path.join(self.root_dir, name_b)
+    options.path_exists(path_a).AndReturn(True)
+    options.path_exists(os.path.join(path_a, '.git')).AndReturn(False)
+    options.path_exists(path_b).AndReturn(True)
+    options.path_exists(os.path.join(path_b, '.git')).AndReturn(False)
+    gclient.CaptureSVNInfoBatch(options, [path_a, path_b], '.').AndReturn({})
+
+    # Expect a check for the entries file and we say there is not one, then
+    # the entries file written after everything is done.
+    self._ExpectEntries(options, entries_content)
 
     # An scm will be requested for the first solution.
     options.scm_wrapper(url_a, self.root_dir, name_a).AndReturn(
         scm_wrapper_a)
     # Then an attempt will be made to read it's DEPS file.
-    gclient.FileRead(os.path.join(self.root_dir, name_a, options.deps_file)
-        ).AndReturn(deps_a)
+    self._ExpectDepsFile(options, name_a, deps_a)
     # Then an update will be performed.
     scm_wrapper_a.RunCommand('update', options, self.args, [])
 
@@ -679,8 +878,7 @@ class GClientClassTestCase(GclientTestCase):
     options.scm_wrapper(url_b, self.root_dir, name_b).AndReturn(
         scm_wrapper_b)
     # Then an attempt will be made to read its DEPS file.
-    gclient.FileRead(os.path.join(self.root_dir, name_b, options.deps_file)
-        ).AndReturn(deps_b)
+    self._ExpectDepsFile(options, name_b, deps_b)
     # Then an update will be performed.
     scm_wrapper_b.RunCommand('update', options, self.args, [])
 
@@ -690,10 +888,6 @@ class GClientClassTestCase(GclientTestCase):
     # And an update is run on it.
     scm_wrapper_dep.RunCommand('update', options, self.args, [])
 
-    # After everything is done, an attempt is made to write an entries file.
-    gclient.FileWrite(os.path.join(self.root_dir, options.entries_filename),
-        entries_content)
-
     self.mox.ReplayAll()
     client = gclient.GClient(self.root_dir, options)
     client.SetConfig(gclient_config)
@@ -703,24 +897,77 @@ class GClientClassTestCase(GclientTestCase):
   def testRunOnDepsSuccess(self):
     # Fake .gclient file.
     name = 'testRunOnDepsSuccess_solution_name'
-    gclient_config = """solutions = [ {
-  'name': '%s',
-  'url': '%s',
-  'custom_deps': {},
-}, ]""" % (name, self.url)
+    gclient_config = self._SolutionConfig(name)
 
     # pymox has trouble to mock the class object and not a class instance.
     self.scm_wrapper = self.mox.CreateMockAnything()
     options = self.Options()
-    options.path_exists(os.path.join(self.root_dir, options.entries_filename)
-        ).AndReturn(False)
+    self._ExpectEntries(options, 'entries = [\n  "%s",\n]\n' % name)
     options.scm_wrapper(self.url, self.root_dir, name).AndReturn(
         options.scm_wrapper)
     options.scm_wrapper.RunCommand('update', options, self.args, [])
-    gclient.FileRead(os.path.join(self.root_dir, name, options.deps_file)
-        ).AndReturn("Boo = 'a'")
-    gclient.FileWrite(os.path.join(self.root_dir, options.entries_filename),
-                      'entries = [\n  "%s",\n]\n' % name)
+    self._ExpectDepsFile(options, name, "Boo = 'a'")
+
+    self.mox.ReplayAll()
+    client = gclient.GClient(self.root_dir, options)
+    client.SetConfig(gclient_config)
+    client.RunOnDeps('update', self.args)
+    self.mox.VerifyAll()
+
+  def testRunOnDepsNestedOrphans(self):
+    # An orphaned entry inside a deleted one isn't looked at.
+    name = 'testRunOnDepsNestedOrphans_solution_name'
+    gclient_config = self._SolutionConfig(name)
+
+    self.scm_wrapper = self.mox.CreateMockAnything()
+    options = self.Options()
+    options.scm_wrapper(self.url, self.root_dir, name).AndReturn(
+        options.scm_wrapper)
+    options.scm_wrapper.RunCommand('update', options, self.args, [])
+    self._ExpectDepsFile(options, name, "Boo = 'a'")
+    entries_file = os.path.join(self.root_dir, options.entries_filename)
+    options.path_exists(entries_file).AndReturn(True)
+    gclient.FileRead(entries_file).AndReturn(
+        'entries = ["old/sub", "%s", "old"]\n' % name)
+    old_dir = os.path.join(self.root_dir, 'old')
+    options.path_exists(old_dir).AndReturn(True)
+    gclient.CaptureSVNStatus(options, old_dir).AndReturn([])
+    self.ExpectPrint(options.stdout,
+                     "\n________ deleting 'old' in '%s'" % self.root_dir)
+    gclient.RemoveDirectory(old_dir)
+    gclient.FileWrite(entries_file, 'entries = [\n  "%s",\n]\n' % name)
+
+    self.mox.ReplayAll()
+    client = gclient.GClient(self.root_dir, options)
+    client.SetConfig(gclient_config)
+    client.RunOnDeps('update', self.args)
+    self.mox.VerifyAll()
+
+  def testRunOnDepsModifiedOrphan(self):
+    # An orphaned entry with local changes is kept, with a warning.
+    name = 'testRunOnDepsModifiedOrphan_solution_name'
+    gclient_config = self._SolutionConfig(name)
+
+    self.scm_wrapper = self.mox.CreateMockAnything()
+    options = self.Options()
+    options.scm_wrapper(self.url, self.root_dir, name).AndReturn(
+        options.scm_wrapper)
+    options.scm_wrapper.RunCommand('update', options, self.args, [])
+    self._ExpectDepsFile(options, name, "Boo = 'a'")
+    entries_file = os.path.join(self.root_dir, options.entries_filename)
+    options.path_exists(entries_file).AndReturn(True)
+    gclient.FileRead(entries_file).AndReturn(
+        'entries = ["%s", "old"]\n' % name)
+    old_dir = os.path.join(self.root_dir, 'old')
+    options.path_exists(old_dir).AndReturn(True)
+    gclient.CaptureSVNStatus(options, old_dir).AndReturn(
+        [gclient.FileStatus('a', 'M', ' ', ' ')])
+    self.ExpectPrint(options.stdout,
+                     '\nWARNING: "old" is no longer part of this client.  '
+                     'It is recommended that you manually remove it.\n')
+    # The order of the entries isn't specified.
+    gclient.FileWrite(entries_file, mox.And(mox.StrContains('"%s"' % name),
+                                            mox.StrContains('"old"')))
 
     self.mox.ReplayAll()
     client = gclient.GClient(self.root_dir, options)
@@ -731,11 +978,11 @@ class GClientClassTestCase(GclientTestCase):
   def testRunOnDepsRevisions(self):
     def OptIsRev(options, rev):
       if not options.revision == str(rev):
-        print "options.revision = %s" % options.revision
+        print("options.revision = %s" % options.revision)
       return options.revision == str(rev)
     def OptIsRevNone(options):
       if options.revision:
-        print "options.revision = %s" % options.revision
+        print("options.revision = %s" % options.revision)
       return options.revision == None
     def OptIsRev42(options):
       return OptIsRev(options, 42)
@@ -745,11 +992,7 @@ class GClientClassTestCase(GclientTestCase):
       return OptIsRev(options, 333)
 
     # Fake .gclient file.
-    gclient_config = """solutions = [ {
-  'name': 'src',
-  'url': '%s',
-  'custom_deps': {},
-}, ]""" % self.url
+    gclient_config = self._SolutionConfig('src')
     # Fake DEPS file.
     deps_content = """deps = {
   'src/breakpad/bar': 'http://google-breakpad.googlecode.com/svn/trunk/src@285',
@@ -789,27 +1032,26 @@ deps_os = {
 
     # Also, pymox doesn't verify the order of function calling w.r.t. different
     # mock objects. Pretty lame. So reorder as we wish to make it clearer.
-    gclient.FileRead(os.path.join(self.root_dir, 'src', options.deps_file)
-        ).AndReturn(deps_content)
-    gclient.FileWrite(os.path.join(self.root_dir, options.entries_filename),
-                      entries_content)
+    self._ExpectDepsFile(options, 'src', deps_content)
 
-    options.path_exists(os.path.join(self.root_dir, options.entries_filename)
-        ).AndReturn(False)
+    # None of the deps is checked out yet.
+    for dep in ('foo/third_party/WebKit', 'src/breakpad/bar',
+                'src/third_party/cygwin', 'src/third_party/python_24'):
+      options.path_exists(os.path.join(self.root_dir, dep)).AndReturn(False)
+    self._ExpectEntries(options, entries_content)
 
     options.scm_wrapper(self.url, self.root_dir, 'src').AndReturn(
         scm_wrapper_src)
     scm_wrapper_src.RunCommand('update', mox.Func(OptIsRev123), self.args, [])
 
+    # A single scm resolves all the relative urls of the solution, in the
+    # order of the deps dict.
     options.scm_wrapper(self.url, self.root_dir,
                         None).AndReturn(scm_wrapper_src2)
     scm_wrapper_src2.FullUrlForRelativeUrl('/trunk/deps/third_party/cygwin@3248'
-        ).AndReturn(cygwin_path)
-
-    options.scm_wrapper(self.url, self.root_dir,
-                        None).AndReturn(scm_wrapper_src2)
+        ).InAnyOrder().AndReturn(cygwin_path)
     scm_wrapper_src2.FullUrlForRelativeUrl('/trunk/deps/third_party/WebKit'
-        ).AndReturn(webkit_path)
+        ).InAnyOrder().AndReturn(webkit_path)
 
     options.scm_wrapper(webkit_path, self.root_dir,
                         'foo/third_party/WebKit').AndReturn(scm_wrapper_webkit)
@@ -842,12 +1084,7 @@ deps_os = {
   def testRunOnDepsConflictingRevisions(self):
     # Fake .gclient file.
     name = 'testRunOnDepsConflictingRevisions_solution_name'
-    gclient_config = """solutions = [ {
-  'name': '%s',
-  'url': '%s',
-  'custom_deps': {},
-  'custom_vars': {},
-}, ]""" % (name, self.url)
+    gclient_config = self._SolutionConfig(name, {})
     # Fake DEPS file.
     deps_content = """deps = {
   'foo/third_party/WebKit': '/trunk/deps/third_party/WebKit',
@@ -861,7 +1098,7 @@ deps_os = {
     exception = "Conflicting revision numbers specified."
     try:
       client.RunOnDeps('update', self.args)
-    except gclient.Error, e:
+    except gclient.Error as e:
       self.assertEquals(e.args[0], exception)
     else:
       self.fail('%s not raised' % exception)
@@ -869,12 +1106,7 @@ deps_os = {
   def testRunOnDepsSuccessVars(self):
     # Fake .gclient file.
     name = 'testRunOnDepsSuccessVars_solution_name'
-    gclient_config = """solutions = [ {
-  'name': '%s',
-  'url': '%s',
-  'custom_deps': {},
-  'custom_vars': {},
-}, ]""" % (name, self.url)
+    gclient_config = self._SolutionConfig(name, {})
     # Fake DEPS file.
     deps_content = """vars = {
   'webkit': '/trunk/bar/',
@@ -894,13 +1126,9 @@ deps = {
     scm_wrapper_src = self.mox.CreateMock(gclient.SCMWrapper)
 
     options = self.Options()
-    gclient.FileRead(os.path.join(self.root_dir, name, options.deps_file)
-        ).AndReturn(deps_content)
-    gclient.FileWrite(os.path.join(self.root_dir, options.entries_filename),
-                      entries_content)
+    self._ExpectDepsFile(options, name, deps_content)
 
-    options.path_exists(os.path.join(self.root_dir, options.entries_filename)
-        ).AndReturn(False)
+    self._ExpectEntries(options, entries_content)
     options.scm_wrapper(self.url, self.root_dir, name).AndReturn(
         options.scm_wrapper)
     options.scm_wrapper.RunCommand('update', options, self.args, [])
@@ -923,12 +1151,8 @@ deps = {
   def testRunOnDepsSuccessCustomVars(self):
     # Fake .gclient file.
     name = 'testRunOnDepsSuccessCustomVars_solution_name'
-    gclient_config = """solutions = [ {
-  'name': '%s',
-  'url': '%s',
-  'custom_deps': {},
-  'custom_vars': {'webkit': '/trunk/bar_custom/'},
-}, ]""" % (name, self.url)
+    gclient_config = self._SolutionConfig(
+        name, {'webkit': '/trunk/bar_custom/'})
     # Fake DEPS file.
     deps_content = """vars = {
   'webkit': '/trunk/bar/',
@@ -948,13 +1172,9 @@ deps = {
     scm_wrapper_src = self.mox.CreateMock(gclient.SCMWrapper)
 
     options = self.Options()
-    gclient.FileRead(os.path.join(self.root_dir, name, options.deps_file)
-        ).AndReturn(deps_content)
-    gclient.FileWrite(os.path.join(self.root_dir, options.entries_filename),
-                      entries_content)
+    self._ExpectDepsFile(options, name, deps_content)
 
-    options.path_exists(os.path.join(self.root_dir, options.entries_filename)
-        ).AndReturn(False)
+    self._ExpectEntries(options, entries_content)
     options.scm_wrapper(self.url, self.root_dir, name).AndReturn(
         options.scm_wrapper)
     options.scm_wrapper.RunCommand('update', options, self.args, [])
@@ -977,12 +1197,7 @@ deps = {
   def testRunOnDepsFailueVars(self):
     # Fake .gclient file.
     name = 'testRunOnDepsFailureVars_solution_name'
-    gclient_config = """solutions = [ {
-  'name': '%s',
-  'url': '%s',
-  'custom_deps': {},
-  'custom_vars': {},
-}, ]""" % (name, self.url)
+    gclient_config = self._SolutionConfig(name, {})
     # Fake DEPS file.
     deps_content = """deps = {
   'foo/third_party/WebKit': Var('webkit') + 'WebKit',
@@ -992,13 +1207,9 @@ deps = {
     self.scm_wrapper = self.mox.CreateMockAnything()
 
     options = self.Options()
-    gclient.FileRead(os.path.join(self.root_dir, name, options.deps_file)
-        ).AndReturn(deps_content)
-    gclient.FileWrite(os.path.join(self.root_dir, options.entries_filename),
-                      'dummy entries content')
+    self._ExpectDepsFile(options, name, deps_content)
 
-    options.path_exists(os.path.join(self.root_dir, options.entries_filename)
-        ).AndReturn(False)
+    self._ExpectEntries(options, 'dummy entries content')
     options.scm_wrapper(self.url, self.root_dir, name).AndReturn(
         options.scm_wrapper)
     options.scm_wrapper.RunCommand('update', options, self.args, [])
@@ -1009,11 +1220,266 @@ deps = {
     exception = "Var is not defined: webkit"
     try:
       client.RunOnDeps('update', self.args)
-    except gclient.Error, e:
+    except gclient.Error as e:
       self.assertEquals(e.args[0], exception)
     else:
       self.fail('%s not raised' % exception)
 
+  def testRunOnDepsParallelNested(self):
+    # A dependency nested in another one waits for its parent to be done, even
+    # when running in parallel.  The output of each dependency is flushed in
+    # one piece at the end.
+    name = 'testRunOnDepsParallelNested_solution_name'
+    gclient_config = self._SolutionConfig(name)
+    deps_content = """deps = {
+  'src/t/nested': 'svn://scm.t/trunk/nested',
+  'src/t': 'svn://scm.t/trunk',
+}"""
+    entries_content = (
+      'entries = [\n  "src/t",\n'
+      '  "%s",\n'
+      '  "src/t/nested",\n'
+      ']\n') % name
+
+    self.scm_wrapper = self.mox.CreateMockAnything()
+    scm_wrapper_t = self.mox.CreateMock(gclient.SCMWrapper)
+    scm_wrapper_nested = self.mox.CreateMock(gclient.SCMWrapper)
+    options = self.Options()
+    options.jobs = 2
+
+    options.path_exists(os.path.join(self.root_dir, 'src/t')).AndReturn(False)
+    options.path_exists(os.path.join(self.root_dir, 'src/t/nested')
+        ).AndReturn(False)
+    self._ExpectEntries(options, entries_content)
+    options.scm_wrapper(self.url, self.root_dir, name).AndReturn(
+        options.scm_wrapper)
+    options.scm_wrapper.RunCommand('update', options, self.args, [])
+    self._ExpectDepsFile(options, name, deps_content)
+
+    def WriteOutput(command, task_options, args, file_list):
+      self.assertTrue(task_options.buffered_output)
+      task_options.stdout.write('output of %s\n' % command)
+      file_list.append('a_file')
+    options.scm_wrapper('svn://scm.t/trunk', self.root_dir, 'src/t'
+        ).AndReturn(scm_wrapper_t)
+    scm_wrapper_t.RunCommand('update', mox.IgnoreArg(), self.args,
+                             mox.IgnoreArg()).WithSideEffects(WriteOutput)
+    options.scm_wrapper('svn://scm.t/trunk/nested', self.root_dir,
+                        'src/t/nested').AndReturn(scm_wrapper_nested)
+    scm_wrapper_nested.RunCommand('update', mox.IgnoreArg(), self.args,
+                                  mox.IgnoreArg())
+    options.stdout.write('output of update\n')
+
+    self.mox.ReplayAll()
+    client = gclient.GClient(self.root_dir, options)
+    client.SetConfig(gclient_config)
+    client.RunOnDeps('update', self.args)
+    self.mox.VerifyAll()
+
+  def testRunOnDepsParallelNestedFailure(self):
+    # A dependency nested in one that failed to update is skipped.
+    name = 'testRunOnDepsParallelNestedFailure_solution_name'
+    gclient_config = self._SolutionConfig(name)
+    deps_content = """deps = {
+  'src/t/nested': 'svn://scm.t/trunk/nested',
+  'src/t': 'svn://scm.t/trunk',
+}"""
+
+    self.scm_wrapper = self.mox.CreateMockAnything()
+    scm_wrapper_t = self.mox.CreateMock(gclient.SCMWrapper)
+    options = self.Options()
+    options.jobs = 2
+
+    options.path_exists(os.path.join(self.root_dir, 'src/t')).AndReturn(False)
+    options.path_exists(os.path.join(self.root_dir, 'src/t/nested')
+        ).AndReturn(False)
+    options.scm_wrapper(self.url, self.root_dir, name).AndReturn(
+        options.scm_wrapper)
+    options.scm_wrapper.RunCommand('update', options, self.args, [])
+    self._ExpectDepsFile(options, name, deps_content)
+    options.scm_wrapper('svn://scm.t/trunk', self.root_dir, 'src/t'
+        ).AndReturn(scm_wrapper_t)
+    scm_wrapper_t.RunCommand('update', mox.IgnoreArg(), self.args,
+                             mox.IgnoreArg()).AndRaise(
+                                 gclient.Error('svn update failed'))
+
+    self.mox.ReplayAll()
+    client = gclient.GClient(self.root_dir, options)
+    client.SetConfig(gclient_config)
+    self.assertRaisesError('svn update failed', client.RunOnDeps, 'update',
+                           self.args)
+    self.mox.VerifyAll()
+
+  def testRunCommandOnModulesDeferredNested(self):
+    # The deferred 'svn update' of a checkout is run before the checkouts
+    # nested in it are handled; the others still share one svn run.
+    modules = [('src/a', 'svn://scm.a/trunk'),
+               ('src/a/nested', 'svn://scm.a/trunk/nested'),
+               ('src/b', 'svn://scm.b/trunk')]
+    self.scm_wrapper = self.mox.CreateMockAnything()
+    options = self.Options()
+    events = []
+    def Defer(path):
+      def RunCommand(command, task_options, args, file_list):
+        events.append(path)
+        task_options.deferred_updates.append((None, path))
+      return RunCommand
+    client = gclient.GClient(self.root_dir, options)
+    self.mox.StubOutWithMock(client, '_PrefetchSVNInfo')
+    client._PrefetchSVNInfo(modules, {}).AndReturn({})
+    for name, url in modules:
+      scm_wrapper = self.mox.CreateMock(gclient.SCMWrapper)
+      options.scm_wrapper(url, self.root_dir, name).AndReturn(scm_wrapper)
+      scm_wrapper.RunCommand('update', options, self.args, []
+          ).WithSideEffects(Defer(name))
+    gclient.RunSVNAndGetFileList(options, ['update', 'src/a'], self.root_dir,
+                                 []).WithSideEffects(
+                                     lambda *args: events.append(args[1]))
+    gclient.RunSVNAndGetFileList(options, ['update', 'src/a/nested', 'src/b'],
+                                 self.root_dir, []).WithSideEffects(
+                                     lambda *args: events.append(args[1]))
+
+    self.mox.ReplayAll()
+    client._RunCommandOnModules('update', self.args, modules, {}, [])
+    self.assertEqual(events, ['src/a', ['update', 'src/a'], 'src/a/nested',
+                              'src/b', ['update', 'src/a/nested', 'src/b']])
+    self.assertEqual(options.deferred_updates, None)
+    self.mox.VerifyAll()
+
+  def testRunOnDepsFromSameModule(self):
+    # Deps inherited from the same module only read its DEPS file once.
+    name = 'testRunOnDepsFromSameModule_solution_name'
+    gclient_config = self._SolutionConfig(name)
+    deps_content = """deps = {
+  'src/foo': 'svn://scm.foo/trunk',
+  'src/a': From('src/foo'),
+  'src/b': From('src/foo'),
+}"""
+    foo_deps_content = """deps = {
+  'src/a': 'svn://scm.a/trunk',
+  'src/b': 'svn://scm.b/trunk',
+}"""
+    entries_content = (
+      'entries = [\n  "src/foo",\n'
+      '  "%s",\n'
+      '  "src/b",\n'
+      '  "src/a",\n'
+      ']\n') % name
+
+    self.scm_wrapper = self.mox.CreateMockAnything()
+    options = self.Options()
+    options.path_exists(os.path.join(self.root_dir, 'src/a')).AndReturn(False)
+    options.path_exists(os.path.join(self.root_dir, 'src/b')).AndReturn(False)
+    self._ExpectEntries(options, entries_content)
+    self._ExpectDepsFile(options, name, deps_content)
+    self._ExpectDepsFile(options, 'src/foo', foo_deps_content)
+    for url, path in ((self.url, name), ('svn://scm.foo/trunk', 'src/foo'),
+                      ('svn://scm.a/trunk', 'src/a'),
+                      ('svn://scm.b/trunk', 'src/b')):
+      options.scm_wrapper(url, self.root_dir, path).AndReturn(
+          options.scm_wrapper)
+      options.scm_wrapper.RunCommand('update', options, self.args, [])
+
+    self.mox.ReplayAll()
+    client = gclient.GClient(self.root_dir, options)
+    client.SetConfig(gclient_config)
+    client.RunOnDeps('update', self.args)
+    self.mox.VerifyAll()
+
+  def testPrefetchSVNInfoHeadRevisions(self):
+    # The HEAD revision of the unpinned checkouts is fetched in one call.
+    options = self.Options()
+    modules = [('src/a', 'svn://a/trunk'), ('src/b', 'svn://b/trunk'),
+               ('src/c', 'svn://c/trunk@3'), ('src/d', 'svn://d/trunk')]
+    infos = {}
+    for name, url in modules:
+      path = os.path.join(self.root_dir, name)
+      options.path_exists(path).AndReturn(True)
+      options.path_exists(os.path.join(path, '.git')).AndReturn(False)
+      infos[path] = gclient.PrintableObject()
+      infos[path].url = url.split('@')[0]
+    paths = [os.path.join(self.root_dir, name) for name, url in modules]
+    gclient.CaptureSVNInfoBatch(options, paths, '.').AndReturn(dict(infos))
+    head_info = gclient.PrintableObject()
+    gclient.CaptureSVNInfoBatch(options, ['svn://a/trunk', 'svn://d/trunk'],
+                                '.').AndReturn({'svn://a/trunk': head_info})
+
+    self.mox.ReplayAll()
+    client = gclient.GClient(self.root_dir, options)
+    result = client._PrefetchSVNInfo(modules, {'src/b': '5'})
+    self.assertEqual(result['svn://a/trunk'], head_info)
+    self.assertEqual(len(result), 5)
+    self.mox.VerifyAll()
+
+  def testParseSolutionDepsExec(self):
+    # DEPS files that don't only assign values are still run.
+    deps_content = """deps = {}
+for name in ('a', 'b'):
+  deps['src/' + name] = 'svn://scm/' + name
+"""
+    options = self.Options()
+
+    self.mox.ReplayAll()
+    client = gclient.GClient(self.root_dir, options)
+    self.assertEqual(client._ParseSolutionDeps('src', deps_content, {}),
+                     {'src/a': 'svn://scm/a', 'src/b': 'svn://scm/b'})
+    self.mox.VerifyAll()
+
+  def testParseSolutionDepsOs(self):
+    deps_content = """deps = {
+  'src/a': 'svn://scm/a',
+  'src/b': 'svn://scm/b',
+}
+deps_os = {
+  'win': {'src/b': None, 'src/w': 'svn://scm/w'},
+  'mac': {'src/m': 'svn://scm/m'},
+  'unix': {'src/b': 'svn://scm/b_unix'},
+}"""
+    base = {'src/a': 'svn://scm/a', 'src/b': 'svn://scm/b'}
+    win = {'src/a': 'svn://scm/a', 'src/b': None, 'src/w': 'svn://scm/w'}
+    mac = dict(base, **{'src/m': 'svn://scm/m'})
+    unix = {'src/a': 'svn://scm/a', 'src/b': 'svn://scm/b_unix'}
+    # Several platforms only add the deps that aren't already specified.
+    every = dict(base, **{'src/m': 'svn://scm/m', 'src/w': 'svn://scm/w'})
+    options = self.Options()
+
+    self.mox.ReplayAll()
+    client = gclient.GClient(self.root_dir, options)
+    for platform, deps_os, expected in (('win32', None, win),
+                                        ('cygwin', None, win),
+                                        ('darwin', None, mac),
+                                        ('linux2', None, unix),
+                                        ('sunos5', None, unix),
+                                        ('win32', 'mac', mac),
+                                        ('win32', 'all', every),
+                                        ('linux2', 'win,mac', every)):
+      options.platform = platform
+      options.deps_os = deps_os
+      self.assertEqual(client._ParseSolutionDeps('src', deps_content, {}),
+                       expected)
+    self.mox.VerifyAll()
+
+  def testParseSolutionDepsCached(self):
+    # A DEPS file is only evaluated once; callers get their own copy.
+    deps_content = """deps = {
+  'src/foo': Var('foo_url'),
+}
+hooks = [{'action': ['true']}]"""
+    custom_vars = {'foo_url': 'svn://scm.foo/trunk', 'flags': ['a', 'b']}
+    options = self.Options()
+
+    self.mox.ReplayAll()
+    client = gclient.GClient(self.root_dir, options)
+    deps = client._ParseSolutionDeps('src', deps_content, custom_vars)
+    deps['src/bar'] = 'svn://scm.bar/trunk'
+    self.assertEqual(client._ParseSolutionDeps('src', deps_content,
+                                               custom_vars),
+                     {'src/foo': 'svn://scm.foo/trunk'})
+    self.assertEqual(len(client._parsed_deps), 1)
+    # The hooks are still queued once per parse, as without the cache.
+    self.assertEqual(client._deps_hooks, [{'action': ['true']}] * 2)
+    self.mox.VerifyAll()
+
   def testRunOnDepsFailureInvalidCommand(self):
     options = self.Options()
 
@@ -1058,29 +1524,343 @@ deps = {
     pass
 
 
+class GenericUtilsTestCase(BaseTestCase):
+  @classmethod
+  def setUpClass(cls):
+    super(GenericUtilsTestCase, cls).setUpClass()
+    # See GclientTestCase.setUpClass.
+    cls._args = Args()
+
+  def setUp(self):
+    BaseTestCase.setUp(self)
+    self.args = self._args
+    # The real FileWrite and os are needed to create files on disk.
+    gclient.FileWrite = self._FileWrite
+    gclient.FileRead = self._FileRead
+    gclient.os = self._os
+
+  def testFindParentPaths(self):
+    paths = ['src/b', 'src', 'other/a', 'src/b/c', 'src2', 'other/a-b',
+             'other/a/b', 'src/d/e']
+    expected = {'src': None, 'src/b': 'src', 'src/b/c': 'src/b', 'src2': None,
+                'other/a': None, 'other/a-b': None, 'other/a/b': 'other/a',
+                'src/d/e': 'src'}
+    self.assertEqual(gclient.FindParentPaths(paths), expected)
+
+  def testFileWrite(self):
+    root_dir = tempfile.mkdtemp()
+    try:
+      filename = os.path.join(root_dir, '.gclient_entries')
+      gclient.FileWrite(filename, 'old')
+      gclient.FileWrite(filename, 'new')
+      self.assertEqual(gclient.FileRead(filename), 'new')
+      self.assertEqual(os.listdir(root_dir), ['.gclient_entries'])
+    finally:
+      shutil.rmtree(root_dir)
+
+  def testFileWriteUmask(self):
+    # A new file gets the mode open() would have given it.
+    root_dir = tempfile.mkdtemp()
+    old_umask = gclient._UMASK
+    try:
+      gclient._UMASK = 0o077
+      filename = os.path.join(root_dir, '.gclient')
+      gclient.FileWrite(filename, 'content')
+      self.assertEqual(os.stat(filename).st_mode & 0o777, 0o600)
+    finally:
+      gclient._UMASK = old_umask
+      shutil.rmtree(root_dir)
+
+  def testFileWriteSymlink(self):
+    root_dir = tempfile.mkdtemp()
+    try:
+      target = os.path.join(root_dir, 'target')
+      link = os.path.join(root_dir, '.gclient')
+      gclient.FileWrite(target, 'old')
+      os.chmod(target, 0o640)
+      os.symlink(target, link)
+      gclient.FileWrite(link, 'new')
+      self.assertTrue(os.path.islink(link))
+      self.assertEqual(gclient.FileRead(target), 'new')
+      self.assertEqual(os.stat(target).st_mode & 0o777, 0o640)
+      self.assertEqual(sorted(os.listdir(root_dir)), ['.gclient', 'target'])
+    finally:
+      shutil.rmtree(root_dir)
+
+  def testFileWriteFailure(self):
+    root_dir = tempfile.mkdtemp()
+    try:
+      filename = os.path.join(root_dir, '.gclient_entries')
+      gclient.FileWrite(filename, 'old')
+      # Only strings can be written.
+      self.assertRaises(TypeError, gclient.FileWrite, filename, 42)
+      self.assertEqual(gclient.FileRead(filename), 'old')
+      self.assertEqual(os.listdir(root_dir), ['.gclient_entries'])
+    finally:
+      shutil.rmtree(root_dir)
+
+  def testReadSVNWorkingCopyInfo(self):
+    root_dir = tempfile.mkdtemp()
+    try:
+      self.assertEqual(self._ReadSVNWorkingCopyInfo(root_dir), None)
+      os.mkdir(os.path.join(root_dir, '.svn'))
+      db = sqlite3.connect(os.path.join(root_dir, '.svn', 'wc.db'))
+      db.executescript("""
+        CREATE TABLE REPOSITORY (id INTEGER PRIMARY KEY, root TEXT, uuid TEXT);
+        CREATE TABLE NODES (local_relpath TEXT, op_depth INTEGER,
+                            repos_id INTEGER, repos_path TEXT,
+                            revision INTEGER, presence TEXT);
+        INSERT INTO REPOSITORY VALUES (1, 'svn://a', 'some-uuid');
+        INSERT INTO NODES VALUES ('', 0, 1, 'trunk/my dir', 35, 'normal');
+        INSERT INTO NODES VALUES ('b', 0, 1, 'trunk/my dir/b', 36, 'normal');
+      """)
+      db.commit()
+      db.close()
+      info = self._ReadSVNWorkingCopyInfo(root_dir)
+      self.assertEqual(info.root, 'svn://a')
+      self.assertEqual(info.url, 'svn://a/trunk/my%20dir')
+      self.assertEqual(info.uuid, 'some-uuid')
+      self.assertEqual(info.revision, 35)
+      # svn is asked about repository roots that aren't ASCII.
+      db = sqlite3.connect(os.path.join(root_dir, '.svn', 'wc.db'))
+      db.execute("UPDATE REPOSITORY SET root = ?", (u'svn://\u00e9',))
+      db.commit()
+      db.close()
+      self.assertEqual(self._ReadSVNWorkingCopyInfo(root_dir), None)
+    finally:
+      shutil.rmtree(root_dir)
+
+  def testResolveCommandPosix(self):
+    gclient.sys.platform = 'linux2'
+    command = [gclient.SVN_COMMAND] + self.args
+    self.assertEqual(gclient.ResolveCommand(command), (command, False))
+
+  def testResolveCommandWindows(self):
+    gclient.sys.platform = 'win32'
+    bin_dir = tempfile.mkdtemp()
+    old_environ = os.environ.copy()
+    try:
+      os.environ['PATH'] = os.pathsep.join([Dir(), bin_dir])
+      os.environ['PATHEXT'] = '.COM;.EXE;.BAT'
+      gclient.FileWrite(os.path.join(bin_dir, 'wrapper.BAT'), '')
+      gclient.FileWrite(os.path.join(bin_dir, 'svn.EXE'), '')
+      # A real executable is run directly, with its full path.
+      self.assertEqual(gclient.ResolveCommand(['svn'] + self.args),
+                       ([os.path.join(bin_dir, 'svn.EXE')] + self.args, False))
+      # A batch file has to go through the shell.
+      self.assertEqual(gclient.ResolveCommand(['wrapper'] + self.args),
+                       (['wrapper'] + self.args, True))
+      # The lookup isn't done again for the same program and %PATH%.
+      os.remove(os.path.join(bin_dir, 'svn.EXE'))
+      self.assertEqual(gclient.ResolveCommand(['svn']),
+                       ([os.path.join(bin_dir, 'svn.EXE')], False))
+    finally:
+      os.environ.clear()
+      os.environ.update(old_environ)
+      shutil.rmtree(bin_dir)
+
+  def testRunInParallel(self):
+    results = []
+    tasks = [lambda i=i: results.append(i) for i in range(10)]
+    gclient.RunInParallel(tasks, 3)
+    self.assertEqual(sorted(results), list(range(10)))
+
+  def testRunInParallelError(self):
+    def Fail():
+      raise gclient.Error('task failed')
+    self.assertRaisesError('task failed', gclient.RunInParallel,
+                           [Fail, Fail], 2)
+
+  def testRunInParallelInterrupt(self):
+    # A worker that gets KeyboardInterrupt stops the run too.
+    results = []
+    def Interrupt():
+      raise KeyboardInterrupt()
+    self.assertRaises(KeyboardInterrupt, gclient.RunInParallel,
+                      [Interrupt, lambda: results.append(1)], 1)
+    self.assertEqual(results, [])
+
+  def testSubprocessCallAndCaptureBuffered(self):
+    # Output that isn't going to the console is read line by line.
+    gclient.sys.platform = 'linux2'
+    out = StringIO()
+    kid = self.mox.CreateMockAnything()
+    kid.stdout = self.mox.CreateMockAnything()
+    gclient.subprocess.Popen(['svn', 'update'], bufsize=0, cwd='dir',
+                             shell=False, stdout=subprocess.PIPE
+                             ).AndReturn(kid)
+    kid.stdout.readline().AndReturn(b'U    a\r\n')
+    # A bare '\r' is dropped rather than turned into a line break.
+    kid.stdout.readline().AndReturn(b'Fetching\rUpdated to revision 42.\n')
+    kid.stdout.readline().AndReturn(b'')
+    kid.wait().AndReturn(0)
+
+    self.mox.ReplayAll()
+    file_list = []
+    gclient.SubprocessCallAndCapture(['svn', 'update'], 'dir', out,
+                                     pattern='^...  (.*)$',
+                                     capture_list=file_list, buffered=True)
+    self.assertEqual(file_list, ['a'])
+    self.assertEqual(out.getvalue(),
+                     "\n________ running 'svn update' in 'dir'\n"
+                     "U    a\nFetchingUpdated to revision 42.\n")
+    self.mox.VerifyAll()
+
+  def testSubprocessCallAndCapturePrompt(self):
+    # Unless told that the output is buffered, it is read byte by byte so that
+    # a prompt shows up even when written to a wrapper around the console.
+    gclient.sys.platform = 'linux2'
+    out = StringIO()
+    kid = self.mox.CreateMockAnything()
+    kid.stdout = self.mox.CreateMockAnything()
+    gclient.subprocess.Popen(['svn', 'update'], bufsize=0, cwd='dir',
+                             shell=False, stdout=subprocess.PIPE
+                             ).AndReturn(kid)
+    for byte in (b'P', b':', b' ', b''):
+      kid.stdout.read(1).AndReturn(byte)
+    kid.wait().AndReturn(0)
+
+    self.mox.ReplayAll()
+    gclient.SubprocessCallAndCapture(['svn', 'update'], 'dir', out)
+    self.assertEqual(out.getvalue(),
+                     "\n________ running 'svn update' in 'dir'\nP: ")
+    self.mox.VerifyAll()
+
+  def testRunSVNUpdates(self):
+    # One svn process per revision, and per batch of checkouts.
+    options = object()
+    file_list = []
+    gclient.RunSVNAndGetFileList(options, ['update', 'a', 'c', '--revision',
+                                           '42'], 'dir', file_list)
+    gclient.RunSVNAndGetFileList(options, ['update', 'd', '--revision', '42'],
+                                 'dir', file_list)
+    gclient.RunSVNAndGetFileList(options, ['update', 'b'], 'dir', file_list)
+
+    self.mox.ReplayAll()
+    old_batch_size = gclient.SVN_UPDATE_BATCH_SIZE
+    gclient.SVN_UPDATE_BATCH_SIZE = 2
+    try:
+      gclient.RunSVNUpdates(options, [(42, 'a'), (None, 'b'), (42, 'c'),
+                                      (42, 'd')], 'dir', file_list)
+    finally:
+      gclient.SVN_UPDATE_BATCH_SIZE = old_batch_size
+    self.mox.VerifyAll()
+
+  def testSplitUrlRevision(self):
+    self.assertEqual(gclient.SplitUrlRevision('svn://a/b@42'),
+                     ('svn://a/b', '42'))
+    self.assertEqual(gclient.SplitUrlRevision('svn://a/b'), ('svn://a/b', None))
+    self.assertEqual(gclient.SplitUrlRevision('svn://user@a/b'),
+                     ('svn://user@a/b', None))
+    self.assertEqual(gclient.SplitUrlRevision('src/a@3'), ('src/a', '3'))
+
+  def testParseSVNInfoMalformed(self):
+    self.assertEqual(gclient.ParseSVNInfo('svn: not a working copy'), [])
+
+  def testEvalDepsSource(self):
+    source = """vars = {'host': 'svn://host'}
+deps = {
+  'src/a': Var('host') + '/a@%d' % 12,
+  'src/b': From('src/a'),
+}
+deps_os = {'win': {'src/c': None}}
+hooks = [{'pattern': '.', 'action': ['python', 'x.py']}]
+use_relative_paths = True
+"""
+    functions = {'From': lambda name: ('From', name),
+                 'Var': lambda name: scope['vars'][name]}
+    scope = {}
+    self.assertTrue(gclient.EvalDepsSource(source, 'DEPS', functions, scope))
+    self.assertEqual(scope['deps'], {'src/a': 'svn://host/a@12',
+                                     'src/b': ('From', 'src/a')})
+    self.assertEqual(scope['deps_os'], {'win': {'src/c': None}})
+    self.assertEqual(scope['hooks'],
+                     [{'pattern': '.', 'action': ['python', 'x.py']}])
+    self.assertEqual(scope['use_relative_paths'], True)
+
+  def testEvalDepsSourceUnsupported(self):
+    for source in ('import os', 'deps = dict(a=1)', 'deps = {}\ndeps[1] = 2',
+                   'deps = From(name="a")', 'deps = [x for x in "ab"]'):
+      self.assertFalse(gclient.EvalDepsSource(source, 'DEPS',
+                                              {'From': lambda name: name}, {}))
+
+  def testCompileCached(self):
+    code = gclient.CompileCached('entries = []\n', 'a/DEPS')
+    self.assertEqual(code.co_filename, 'a/DEPS')
+    self.assertTrue(gclient.CompileCached('entries = []\n', 'a/DEPS') is code)
+    self.assertFalse(gclient.CompileCached('entries = [1]\n', 'a/DEPS') is code)
+
+
 class SCMWrapperTestCase(BaseTestCase):
   class OptionsObject(object):
-     def __init__(self, test_case, verbose=False, revision=None):
+    __slots__ = ('verbose', 'revision', 'manually_grab_svn_rev', 'deps_os',
+                 'force', 'use_pysvn', 'prefetched_svn_info',
+                 'deferred_updates', 'buffered_output', 'stdout',
+                 'path_exists')
+
+    def __init__(self, test_case, verbose=False, revision=None):
       self.verbose = verbose
       self.revision = revision
       self.manually_grab_svn_rev = True
       self.deps_os = None
       self.force = False
+      self.use_pysvn = False
+      self.prefetched_svn_info = {}
+      self.deferred_updates = None
+      self.buffered_output = False
 
       # Mox
       self.stdout = test_case.stdout
       self.path_exists = test_case.path_exists
 
+  @classmethod
+  def setUpClass(cls):
+    super(SCMWrapperTestCase, cls).setUpClass()
+    # See GclientTestCase.setUpClass.
+    cls._root_dir = Dir()
+    cls._args = Args()
+    cls._url = Url()
+    cls._unsupported_args_msg = ("Unsupported argument(s): %s" %
+                                 ','.join(cls._args))
+
   def setUp(self):
     BaseTestCase.setUp(self)
-    self.root_dir = Dir()
-    self.args = Args()
-    self.url = Url()
+    self.root_dir = self._root_dir
+    self.args = self._args
+    self.url = self._url
     self.relpath = 'asf'
     self.stdout = self.mox.CreateMock(sys.stdout)
     # Stub os.path.exists.
     self.path_exists = self.mox.CreateMockAnything()
 
+  def _FileInfo(self):
+    """Returns the svn info of a checkout of self.url at revision 42.
+
+    A new object each time since update() may rewrite its url.
+    """
+    file_info = gclient.PrintableObject()
+    file_info.root = 'blah'
+    file_info.url = self.url
+    file_info.uuid = 'ABC'
+    file_info.revision = 42
+    return file_info
+
+  def _ExpectSteps(self, options, steps):
+    """Records the expectations of an SCMWrapper.update() run, in order.
+
+    Each step is one of ('exists', path, result), ('info', path_or_url, info)
+    or ('svn', args, cwd, file_list).
+    """
+    for step in steps:
+      if step[0] == 'exists':
+        options.path_exists(step[1]).AndReturn(step[2])
+      elif step[0] == 'info':
+        gclient.CaptureSVNInfo(options, step[1], '.').AndReturn(step[2])
+      elif step[0] == 'svn':
+        gclient.RunSVNAndGetFileList(options, step[1], step[2], step[3])
+      else:
+        self.fail('Unknown expectation step %r' % (step,))
+
   def testDir(self):
     members = ['FullUrlForRelativeUrl', 'RunCommand',
       'cleanup', 'diff', 'revert', 'status', 'update']
@@ -1109,8 +1889,8 @@ class SCMWrapperTestCase(BaseTestCase):
     self.mox.ReplayAll()
     scm = gclient.SCMWrapper(url=self.url, root_dir=self.root_dir,
                              relpath=self.relpath)
-    exception = "Unsupported argument(s): %s" % ','.join(self.args)
-    self.assertRaisesError(exception, gclient.SCMWrapper.RunCommand,
+    self.assertRaisesError(self._unsupported_args_msg,
+                           gclient.SCMWrapper.RunCommand,
                            scm, 'update', options, self.args)
     self.mox.VerifyAll()
 
@@ -1120,11 +1900,11 @@ class SCMWrapperTestCase(BaseTestCase):
 
   def testRevertMissing(self):
     options = self.Options(verbose=True)
-    gclient.os.path.isdir = self.mox.CreateMockAnything()
-    gclient.os.path.isdir(os.path.join(self.root_dir, self.relpath)
+    self.mox.StubOutWithMock(os.path, 'isdir')
+    os.path.isdir(os.path.join(self.root_dir, self.relpath)
         ).AndReturn(False)
-    print >>options.stdout, ("\n_____ %s is missing, can't revert" %
-                             self.relpath)
+    self.ExpectPrint(options.stdout,
+                     "\n_____ %s is missing, can't revert" % self.relpath)
 
     self.mox.ReplayAll()
     scm = gclient.SCMWrapper(url=self.url, root_dir=self.root_dir,
@@ -1132,13 +1912,12 @@ class SCMWrapperTestCase(BaseTestCase):
     file_list = []
     scm.revert(options, self.args, file_list)
     self.mox.VerifyAll()
-    gclient.os.path.isdir = os.path.isdir
 
   def testRevertNone(self):
     options = self.Options(verbose=True)
     base_path = os.path.join(self.root_dir, self.relpath)
-    gclient.os.path.isdir = self.mox.CreateMockAnything()
-    gclient.os.path.isdir(base_path).AndReturn(True)
+    self.mox.StubOutWithMock(os.path, 'isdir')
+    os.path.isdir(base_path).AndReturn(True)
     gclient.CaptureSVNStatus(options, base_path).AndReturn([])
 
     self.mox.ReplayAll()
@@ -1147,21 +1926,20 @@ class SCMWrapperTestCase(BaseTestCase):
     file_list = []
     scm.revert(options, self.args, file_list)
     self.mox.VerifyAll()
-    gclient.os.path.isdir = os.path.isdir
 
   def testRevert2Files(self):
     options = self.Options(verbose=True)
     base_path = os.path.join(self.root_dir, self.relpath)
-    gclient.os.path.isdir = self.mox.CreateMockAnything()
-    gclient.os.path.isdir(base_path).AndReturn(True)
+    self.mox.StubOutWithMock(os.path, 'isdir')
+    os.path.isdir(base_path).AndReturn(True)
     items = [
       gclient.FileStatus('a', 'M', ' ', ' '), 
       gclient.FileStatus('b', 'A', ' ', ' '),
     ]
     gclient.CaptureSVNStatus(options, base_path).AndReturn(items)
 
-    print >>options.stdout, os.path.join(base_path, 'a')
-    print >>options.stdout, os.path.join(base_path, 'b')
+    self.ExpectPrint(options.stdout, '\n'.join([os.path.join(base_path, 'a'),
+                                                os.path.join(base_path, 'b')]))
     gclient.RunSVN(options, ['revert', 'a', 'b'], base_path)
 
     self.mox.ReplayAll()
@@ -1170,7 +1948,27 @@ class SCMWrapperTestCase(BaseTestCase):
     file_list = []
     scm.revert(options, self.args, file_list)
     self.mox.VerifyAll()
-    gclient.os.path.isdir = os.path.isdir
+
+  def testRevertLongCommandLine(self):
+    options = self.Options(verbose=True)
+    base_path = os.path.join(self.root_dir, self.relpath)
+    self.mox.StubOutWithMock(os.path, 'isdir')
+    os.path.isdir(base_path).AndReturn(True)
+    names = [c * 1000 for c in 'abcd']
+    items = [gclient.FileStatus(name, 'M', ' ', ' ') for name in names]
+    gclient.CaptureSVNStatus(options, base_path).AndReturn(items)
+    self.ExpectPrint(options.stdout, '\n'.join([os.path.join(base_path, name)
+                                                for name in names]))
+    # No file is left out when the command line is split.
+    gclient.RunSVN(options, ['revert'] + names[:3], base_path)
+    gclient.RunSVN(options, ['revert'] + names[3:], base_path)
+
+    self.mox.ReplayAll()
+    scm = gclient.SCMWrapper(url=self.url, root_dir=self.root_dir,
+                             relpath=self.relpath)
+    file_list = []
+    scm.revert(options, self.args, file_list)
+    self.mox.VerifyAll()
 
   def testStatus(self):
     options = self.Options(verbose=True)
@@ -1191,25 +1989,20 @@ class SCMWrapperTestCase(BaseTestCase):
   def testUpdateCheckout(self):
     options = self.Options(verbose=True)
     base_path = os.path.join(self.root_dir, self.relpath)
-    file_info = gclient.PrintableObject()
-    file_info.root = 'blah'
-    file_info.url = self.url
-    file_info.uuid = 'ABC'
-    file_info.revision = 42
-    options.path_exists(os.path.join(base_path, '.git')).AndReturn(False)
-    # Checkout or update.
-    options.path_exists(base_path).AndReturn(False)
-    print >>options.stdout, "\n_____ asf at 42"
+    file_info = self._FileInfo()
+    self.ExpectPrint(options.stdout, "\n_____ asf at 42")
     #print >>options.stdout, "\n________ running 'svn checkout %s %s' in '%s'" % (
     #    self.url, base_path, os.path.abspath(self.root_dir))
-
-    gclient.CaptureSVNInfo(options, os.path.join(base_path, "."), '.'
-        ).AndReturn(file_info)
-    # Cheat a bit here.
-    gclient.CaptureSVNInfo(options, file_info.url, '.').AndReturn(file_info)
     files_list = self.mox.CreateMockAnything()
-    gclient.RunSVNAndGetFileList(options, ['checkout', self.url, base_path],
-                                 self.root_dir, files_list)
+    self._ExpectSteps(options, [
+      ('exists', os.path.join(base_path, '.git'), False),
+      # Checkout or update.
+      ('exists', base_path, False),
+      ('info', os.path.join(base_path, '.'), file_info),
+      # Cheat a bit here.
+      ('info', file_info.url, file_info),
+      ('svn', ['checkout', self.url, base_path], self.root_dir, files_list),
+    ])
     self.mox.ReplayAll()
     scm = gclient.SCMWrapper(url=self.url, root_dir=self.root_dir,
                              relpath=self.relpath)
@@ -1221,24 +2014,21 @@ class SCMWrapperTestCase(BaseTestCase):
     options = self.Options(verbose=True)
     base_path = os.path.join(self.root_dir, self.relpath)
     options.force = True
-    file_info = gclient.PrintableObject()
-    file_info.root = 'blah'
-    file_info.url = self.url
-    file_info.uuid = 'ABC'
-    file_info.revision = 42
-    options.path_exists(os.path.join(base_path, '.git')).AndReturn(False)
-    # Checkout or update.
-    options.path_exists(base_path).AndReturn(True)
-    gclient.CaptureSVNInfo(options, os.path.join(base_path, "."), '.'
-        ).AndReturn(file_info)
-    # Cheat a bit here.
-    gclient.CaptureSVNInfo(options, file_info.url, '.').AndReturn(file_info)
+    file_info = self._FileInfo()
     additional_args = []
     if options.manually_grab_svn_rev:
       additional_args = ['--revision', str(file_info.revision)]
     files_list = []
-    gclient.RunSVNAndGetFileList(options, ['update', base_path] + additional_args,
-                                 self.root_dir, files_list)
+    self._ExpectSteps(options, [
+      ('exists', os.path.join(base_path, '.git'), False),
+      # Checkout or update.
+      ('exists', base_path, True),
+      ('info', os.path.join(base_path, '.'), file_info),
+      # Cheat a bit here.
+      ('info', file_info.url, file_info),
+      ('svn', ['update', base_path] + additional_args, self.root_dir,
+       files_list),
+    ])
 
     self.mox.ReplayAll()
     scm = gclient.SCMWrapper(url=self.url, root_dir=self.root_dir,
@@ -1246,11 +2036,70 @@ class SCMWrapperTestCase(BaseTestCase):
     scm.update(options, (), files_list)
     self.mox.VerifyAll()
 
+  def testUpdatePrefetchedInfo(self):
+    options = self.Options(verbose=True)
+    base_path = os.path.join(self.root_dir, self.relpath)
+    options.force = True
+    file_info = self._FileInfo()
+    # The info of the checkout was fetched along with other modules'.
+    options.prefetched_svn_info = {base_path: file_info}
+    files_list = []
+    # The prefetch already found the checkout, nothing is probed on disk.
+    self._ExpectSteps(options, [
+      ('info', file_info.url, file_info),
+      ('svn', ['update', base_path, '--revision', '42'], self.root_dir,
+       files_list),
+    ])
+
+    self.mox.ReplayAll()
+    scm = gclient.SCMWrapper(url=self.url, root_dir=self.root_dir,
+                             relpath=self.relpath)
+    scm.update(options, (), files_list)
+    self.mox.VerifyAll()
+
+  def testUpdateTrailingSlash(self):
+    # The checkout's url only lacks the trailing slash; no need to look up the
+    # url it would have to be switched to.
+    options = self.Options(verbose=True)
+    base_path = os.path.join(self.root_dir, self.relpath)
+    options.force = True
+    file_info = self._FileInfo()
+    options.prefetched_svn_info = {base_path: file_info, self.url: file_info}
+    files_list = []
+    # The prefetch already found the checkout, nothing is probed on disk.
+    self._ExpectSteps(options, [
+      ('svn', ['update', base_path, '--revision', '42'], self.root_dir,
+       files_list),
+    ])
+
+    self.mox.ReplayAll()
+    scm = gclient.SCMWrapper(url=self.url + '/', root_dir=self.root_dir,
+                             relpath=self.relpath)
+    scm.update(options, (), files_list)
+    self.mox.VerifyAll()
+
+  def testUpdateDeferred(self):
+    # A plain update is left for the caller to batch with the others.
+    options = self.Options(verbose=True)
+    base_path = os.path.join(self.root_dir, self.relpath)
+    options.force = True
+    options.deferred_updates = []
+    file_info = self._FileInfo()
+    options.prefetched_svn_info = {base_path: file_info, self.url: file_info}
+    # The prefetch already found the checkout, nothing is probed on disk.
+
+    self.mox.ReplayAll()
+    scm = gclient.SCMWrapper(url=self.url, root_dir=self.root_dir,
+                             relpath=self.relpath)
+    scm.update(options, (), [])
+    self.assertEqual(options.deferred_updates, [(42, base_path)])
+    self.mox.VerifyAll()
+
   def testUpdateGit(self):
     options = self.Options(verbose=True)
     options.path_exists(os.path.join(self.root_dir, self.relpath, '.git')
         ).AndReturn(True)
-    print >> options.stdout, (
+    self.ExpectPrint(options.stdout,
         "________ found .git directory; skipping %s" % self.relpath)
 
     self.mox.ReplayAll()
@@ -1295,6 +2144,163 @@ class SCMWrapperTestCase(BaseTestCase):
     self.failUnless(file_info.revision == 35)
     self.mox.VerifyAll()
 
+  def testCaptureSvnStatus(self):
+    xml_text = """<?xml version="1.0"?>
+<status>
+<target path=".">
+<entry path="a">
+<wc-status props="none" item="modified" revision="35"/>
+</entry>
+<entry path="b">
+<wc-status props="modified" item="added" copied="true" revision="-1"/>
+</entry>
+<entry path="c">
+<wc-status props="none" item="unversioned"/>
+</entry>
+</target>
+</status>
+"""
+    options = self.Options(verbose=True)
+    gclient.CaptureSVN(options, ['status', '--xml'], self.root_dir
+        ).AndReturn(xml_text)
+    gclient.CaptureSVN(options, ['status', '--xml'], self.root_dir
+        ).AndReturn('')
+    self.mox.ReplayAll()
+    statuses = self._CaptureSVNStatus(options, self.root_dir)
+    self.assertEqual([str(s) for s in statuses],
+                     ['M    a', 'AM + b', '?    c'])
+    # svn failed and printed nothing.
+    self.assertEqual(self._CaptureSVNStatus(options, self.root_dir), [])
+    self.mox.VerifyAll()
+
+  def testCaptureSvnInfoPySVN(self):
+    # With the pysvn bindings and --pysvn, no svn process is started unless
+    # pysvn fails.
+    client = self.mox.CreateMockAnything()
+    class FakePySVN(object):
+      ClientError = gclient.Error
+      class opt_revision_kind(object):
+        number = 'number'
+        head = 'head'
+      class Revision(object):
+        def __init__(self, *args):
+          self.args = args
+        def __eq__(self, other):
+          return self.args == other.args
+      @staticmethod
+      def Client():
+        return client
+    revision = gclient.PrintableObject()
+    revision.number = 35
+    rev_35 = FakePySVN.Revision('number', 35)
+    options = self.Options(verbose=True)
+    options.use_pysvn = True
+    gclient.ReadSVNWorkingCopyInfo(os.path.join(self.root_dir, 'a'))
+    client.info2(os.path.join(self.root_dir, 'a'), recurse=False).AndReturn(
+        [('a', {'repos_root_URL': self.url, 'URL': self.url + '/a',
+                'repos_UUID': '7b9385f5-0452-0410-af26-ad4892b7a1fb',
+                'rev': revision})])
+    client.info2(self.url + '/b', recurse=False, peg_revision=rev_35,
+                 revision=rev_35).AndReturn(
+        [('b', {'repos_root_URL': self.url, 'URL': self.url + '/b',
+                'repos_UUID': '7b9385f5-0452-0410-af26-ad4892b7a1fb',
+                'rev': revision})])
+    client.info2(self.url, recurse=False).AndRaise(gclient.Error('no auth'))
+    gclient.CaptureSVN(options, ['info', '--xml', self.url], '.').AndReturn(
+        '<info><entry revision="36"><url>%s</url><repository><root>%s</root>'
+        '<uuid>7b9385f5-0452-0410-af26-ad4892b7a1fb</uuid></repository>'
+        '</entry></info>' % (self.url, self.url))
+
+    self.mox.ReplayAll()
+    gclient.pysvn = FakePySVN
+    try:
+      file_info = self._CaptureSVNInfo(options, 'a', self.root_dir)
+      url_info = self._CaptureSVNInfo(options, self.url + '/b@35', '.')
+      fallback_info = self._CaptureSVNInfo(options, self.url, '.')
+    finally:
+      del gclient._pysvn_clients.client
+    self.assertEqual(file_info.root, self.url)
+    self.assertEqual(file_info.url, self.url + '/a')
+    self.assertEqual(file_info.uuid, '7b9385f5-0452-0410-af26-ad4892b7a1fb')
+    self.assertEqual(file_info.revision, 35)
+    self.assertEqual(url_info.url, self.url + '/b')
+    self.assertEqual(fallback_info.url, self.url)
+    self.assertEqual(fallback_info.revision, 36)
+    self.mox.VerifyAll()
+
+  def testCaptureSvnInfoPySVNNotRequested(self):
+    # pysvn can't prompt for credentials, so svn is used without --pysvn.
+    options = self.Options(verbose=True)
+    gclient.CaptureSVN(options, ['info', '--xml', self.url], '.').AndReturn(
+        '<info><entry revision="36"><url>%s</url><repository><root>%s</root>'
+        '<uuid>7b9385f5-0452-0410-af26-ad4892b7a1fb</uuid></repository>'
+        '</entry></info>' % (self.url, self.url))
+
+    self.mox.ReplayAll()
+    gclient.pysvn = self.mox.CreateMockAnything()
+    file_info = self._CaptureSVNInfo(options, self.url, '.')
+    self.assertEqual(file_info.revision, 36)
+    self.mox.VerifyAll()
+
+  def testCaptureSvnInfoBatch(self):
+    entry = """<entry
+   kind="dir"
+   path="%s"
+   revision="%d">
+<url>%s</url>
+<repository>
+<root>%s</root>
+<uuid>7b9385f5-0452-0410-af26-ad4892b7a1fb</uuid>
+</repository>
+</entry>
+"""
+    xml_text = ('<?xml version="1.0"?>\n<info>\n' +
+                entry % ('a', 35, self.url + '/a', self.url) +
+                entry % ('b', 36, self.url + '/b', self.url) +
+                '</info>\n')
+    d_info = gclient.PrintableObject()
+    d_info.url = self.url + '/d'
+    options = self.Options(verbose=True)
+    for relpath in ('a/.', 'b', 'c'):
+      gclient.ReadSVNWorkingCopyInfo(os.path.join(self.root_dir, relpath))
+    # svn isn't asked about 'd', its wc.db could be read.
+    gclient.ReadSVNWorkingCopyInfo(os.path.join(self.root_dir, 'd')
+        ).AndReturn(d_info)
+    gclient.CaptureSVN(options, ['info', '--xml', 'a/.', 'b', 'c'],
+                       self.root_dir).AndReturn(xml_text)
+    self.mox.ReplayAll()
+    infos = self._CaptureSVNInfoBatch(options, ['a/.', 'b', 'c', 'd'],
+                                      self.root_dir)
+    # 'c' isn't a working copy so svn skipped it.
+    self.assertEqual(sorted(infos.keys()), ['a/.', 'b', 'd'])
+    self.assertEqual(infos['d'], d_info)
+    self.assertEqual(infos['a/.'].url, self.url + '/a')
+    self.assertEqual(infos['a/.'].revision, 35)
+    self.assertEqual(infos['b'].url, self.url + '/b')
+    self.assertEqual(infos['b'].root, self.url)
+    self.assertEqual(infos['b'].revision, 36)
+    self.mox.VerifyAll()
+
+  def testCaptureSvnInfoBatchUrls(self):
+    # svn prints url targets escaped and without a trailing '/'.
+    entry = ('<entry kind="dir" path="%s" revision="42"><url>%s</url>'
+             '<repository><root>svn://h</root><uuid>some-uuid</uuid>'
+             '</repository></entry>')
+    xml_text = ('<?xml version="1.0"?>\n<info>\n' +
+                entry % ('x', 'svn://h/x') +
+                entry % ('my dir', 'svn://h/my%20dir') +
+                '</info>\n')
+    options = self.Options(verbose=True)
+    urls = ['svn://h/x/', 'svn://h/my dir', 'svn://h/y']
+    gclient.CaptureSVN(options, ['info', '--xml'] + urls, '.'
+        ).AndReturn(xml_text)
+    self.mox.ReplayAll()
+    infos = self._CaptureSVNInfoBatch(options, urls, '.')
+    self.assertEqual(sorted(infos.keys()), ['svn://h/my dir', 'svn://h/x/'])
+    self.assertEqual(infos['svn://h/x/'].url, 'svn://h/x')
+    self.assertEqual(infos['svn://h/my dir'].url, 'svn://h/my%20dir')
+    self.mox.VerifyAll()
+
 
 if __name__ == '__main__':
   unittest.main()